@@ -0,0 +1,252 @@
+"""Benchmarks every stage of the processing pipeline on synthetic data.
+
+Run:
+    python benchmark.py run -o results.json
+    python benchmark.py compare baseline.json results.json
+    python benchmark.py baselines
+    python benchmark.py filter_bank
+
+The float32 accuracy and the import time budgets of the startup modules are checked by
+tests/test_dtype.py and tests/test_imports.py.
+"""
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+import io
+import json
+from os.path import join
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import scipy
+
+from wavey.data import Data
+from wavey.synthetic import make_baseline, write_dataset, write_weights
+
+BASELINE_CONFIGS = {'lambda': 1e5, 'stop_ratio': 1e-6, 'max_iters': 100}
+# Baseline methods compared by the baselines command, with their configs
+BASELINE_METHODS = {
+    Data.BASELINE_ARPLS: BASELINE_CONFIGS,
+    Data.BASELINE_SNIP: {'max_half_window': 40, 'smooth_half_window': 5},
+    Data.BASELINE_ROLLING_BALL: {'half_window': 40, 'smooth_half_window': 5},
+}
+class StageTimer:
+    """Times a stage and records its peak traced allocation."""
+
+    def __init__(self, trace_memory: bool) -> None:
+        self.trace_memory = trace_memory
+
+    def __call__(self, fn):
+        if self.trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        with redirect_stdout(io.StringIO()):
+            result = fn()
+        seconds = time.perf_counter() - start
+        peak_bytes = None
+        if self.trace_memory:
+            peak_bytes = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        return result, seconds, peak_bytes
+
+
+def run_once(in_dir: str, out_dir: str, weight_fpath: str, ftype: str, num_time_points: int,
+             trace_memory: bool, dtype: str='float64') -> dict:
+    """Returns {stage: (seconds, peak_bytes)} for one pass through the pipeline."""
+    timer = StageTimer(trace_memory)
+    stages = {}
+    data, seconds, peak_bytes = timer(
+        lambda: Data(in_dir=in_dir, num_time_points=num_time_points, ftype=ftype, dtype=dtype))
+    stages['load'] = (seconds, peak_bytes)
+    pipeline = [
+        ('baseline_correct', lambda: data.baseline_correct('arpls', dict(BASELINE_CONFIGS))),
+        ('fourier_transform', data.fourier_transform),
+        ('weight', lambda: data.weight(weight_fpath)),
+        ('inverse_fourier_transform', data.inverse_fourier_transform),
+        ('save_to', lambda: data.save_to(join(out_dir, 'transformed_data.csv'))),
+    ]
+    for stage, fn in pipeline:
+        _, seconds, peak_bytes = timer(fn)
+        stages[stage] = (seconds, peak_bytes)
+    return stages
+
+
+def run_benchmarks(ftypes, num_sampling_points: int, num_time_points: int, num_repeats: int,
+                   repeat: int, trace_memory: bool, dtype: str='float64') -> dict:
+    results = []
+    num_values = num_sampling_points * num_time_points
+    for ftype in ftypes:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            in_dir = join(tmp_dir, 'spectra')
+            fpaths = write_dataset(in_dir, ftype, num_sampling_points, num_time_points, num_repeats)
+            weight_fpath = join(tmp_dir, 'weights.csv')
+            write_weights(weight_fpath, num_time_points)
+            runs = [run_once(in_dir, tmp_dir, weight_fpath, ftype, num_time_points, trace_memory=False,
+                             dtype=dtype)
+                    for _ in range(repeat)]
+            # Tracing allocations slows the stages down, peaks are measured in a separate pass
+            traced_run = None
+            if trace_memory:
+                traced_run = run_once(in_dir, tmp_dir, weight_fpath, ftype, num_time_points, trace_memory=True,
+                                      dtype=dtype)
+        for stage in runs[0]:
+            seconds = min(run[stage][0] for run in runs)
+            peak_bytes = None if traced_run is None else traced_run[stage][1]
+            if stage == 'load':
+                throughput, unit = len(fpaths) / seconds, 'files/s'
+            else:
+                throughput, unit = num_values / seconds, 'values/s'
+            results.append({
+                'ftype': ftype, 'stage': stage, 'seconds': seconds, 'peak_bytes': peak_bytes,
+                'throughput': throughput, 'throughput_unit': unit,
+            })
+            print(f'{ftype:>6} {stage:>26} {seconds * 1e3:10.2f} ms {throughput:14.1f} {unit}'
+                  + (f' {peak_bytes / 1024 ** 2:9.2f} MiB peak' if peak_bytes is not None else ''))
+    return {
+        'environment': {
+            'python': sys.version.split()[0], 'numpy': np.__version__, 'scipy': scipy.__version__,
+            'platform': platform.platform(), 'processor': platform.processor(),
+        },
+        'parameters': {
+            'num_sampling_points': num_sampling_points, 'num_time_points': num_time_points,
+            'num_repeats': num_repeats, 'repeat': repeat, 'dtype': dtype,
+        },
+        'results': results,
+    }
+
+
+def compare(old: dict, new: dict, threshold: float) -> list:
+    """Returns the (ftype, stage, old_seconds, new_seconds) that got slower by more than threshold."""
+    old_seconds = {(r['ftype'], r['stage']): r['seconds'] for r in old['results']}
+    regressions = []
+    for r in new['results']:
+        key = (r['ftype'], r['stage'])
+        if key not in old_seconds:
+            continue
+        ratio = r['seconds'] / old_seconds[key]
+        flag = 'REGRESSION' if ratio > 1 + threshold else ''
+        print(f'{key[0]:>6} {key[1]:>26} {old_seconds[key] * 1e3:10.2f} ms -> {r["seconds"] * 1e3:10.2f} ms '
+              f'({ratio:5.2f}x) {flag}')
+        if flag:
+            regressions.append((*key, old_seconds[key], r['seconds']))
+    return regressions
+
+
+def compare_baselines(num_sampling_points: int, num_time_points: int, num_repeats: int, repeat: int) -> list:
+    """Times every baseline method on synthetic data and measures its error against the
+    true synthetic baseline, as RMS over all points and over the points away from the peaks."""
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        in_dir = join(tmp_dir, 'spectra')
+        write_dataset(in_dir, Data.IR, num_sampling_points, num_time_points, num_repeats)
+        with redirect_stdout(io.StringIO()):
+            data = Data(in_dir=in_dir, num_time_points=num_time_points, ftype=Data.IR)
+    x, y = data.x, np.array(data.y)
+    true_baseline = make_baseline(x)
+    # The synthetic peaks are at 1000 and 1600 with widths of 30 and 45
+    background = (np.abs(x[:, 0] - 1000) > 90) & (np.abs(x[:, 0] - 1600) > 135)
+    for method, configs in BASELINE_METHODS.items():
+        seconds = []
+        for _ in range(repeat):
+            data = Data.from_arrays(x, y)
+            with redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                data.baseline_correct(method, dict(configs))
+                seconds.append(time.perf_counter() - start)
+        error = data.baseline - true_baseline
+        rms_error = np.sqrt(np.mean(error ** 2))
+        background_rms_error = np.sqrt(np.mean(error[background] ** 2))
+        results.append({'method': method, 'seconds': min(seconds), 'rms_error': rms_error,
+                         'background_rms_error': background_rms_error})
+        print(f'{method:>13} {min(seconds) * 1e3:10.2f} ms   RMS error {rms_error:8.3f}   '
+              f'away from peaks {background_rms_error:8.3f}')
+    return results
+
+
+def compare_filter_bank(num_sampling_points: int, num_time_points: int, num_weights: int, repeat: int,
+                        dtype: str='float64') -> float:
+    """Times Data.filter_bank against one fourier_transform -> weight ->
+    inverse_fourier_transform pass per weight file, each weight file keeping harmonic i + 1.
+
+    Returns:
+        the largest difference between the outputs of the two paths.
+    """
+    x = np.arange(num_sampling_points, dtype=np.float64)[:, None]
+    y = np.random.default_rng(0).standard_normal((num_sampling_points, num_time_points))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        fpaths = [join(tmp_dir, f'weights_{i}.csv') for i in range(num_weights)]
+        for i, fpath in enumerate(fpaths):
+            write_weights(fpath, num_time_points, harmonics=(i + 1,))
+        separate_seconds, bank_seconds = [], []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            separate = []
+            for fpath in fpaths:
+                data = Data.from_arrays(x, y, dtype=dtype)
+                data.fourier_transform().weight(fpath).inverse_fourier_transform()
+                separate.append(data.y)
+            separate_seconds.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            bank = Data.from_arrays(x, y, dtype=dtype).filter_bank(fpaths)
+            bank_seconds.append(time.perf_counter() - start)
+    max_difference = max(float(np.max(np.abs(a - b))) for a, b in zip(separate, bank))
+    print(f'{num_weights} weightings: separate {min(separate_seconds) * 1e3:10.2f} ms   '
+          f'filter bank {min(bank_seconds) * 1e3:10.2f} ms   max difference {max_difference:.3g}')
+    return max_difference
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run_parser = subparsers.add_parser('run', help='Time every stage on synthetic data')
+    run_parser.add_argument('-o', '--output', default='benchmark.json', help='Path of the JSON results')
+    run_parser.add_argument('-ft', '--ftypes', nargs='+', default=[Data.RAMAN, Data.IR, Data.UV_VIS])
+    run_parser.add_argument('-ns', '--num_sampling_points', type=int, default=1024)
+    run_parser.add_argument('-nt', '--num_time', type=int, default=60, help='Number of time points')
+    run_parser.add_argument('-nr', '--num_repeats', type=int, default=2)
+    run_parser.add_argument('-r', '--repeat', type=int, default=3, help='Runs per stage, the fastest is kept')
+    run_parser.add_argument('--no_memory', action='store_true', help='Do not trace peak allocations')
+    run_parser.add_argument('--dtype', default='float64', choices=Data.DTYPES)
+    compare_parser = subparsers.add_parser('compare', help='Flag stages that got slower')
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('-t', '--threshold', type=float, default=0.1,
+                                help='Relative slow down reported as a regression')
+    baselines_parser = subparsers.add_parser('baselines', help='Compare the speed and error of the baseline methods')
+    baselines_parser.add_argument('-ns', '--num_sampling_points', type=int, default=1024)
+    baselines_parser.add_argument('-nt', '--num_time', type=int, default=60, help='Number of time points')
+    baselines_parser.add_argument('-nr', '--num_repeats', type=int, default=2)
+    baselines_parser.add_argument('-r', '--repeat', type=int, default=3, help='Runs per method, the fastest is kept')
+    filter_bank_parser = subparsers.add_parser('filter_bank', help='Compare the filter bank to one pass per weight file')
+    filter_bank_parser.add_argument('-ns', '--num_sampling_points', type=int, default=1024)
+    filter_bank_parser.add_argument('-nt', '--num_time', type=int, default=60, help='Number of time points')
+    filter_bank_parser.add_argument('-nw', '--num_weights', type=int, default=8)
+    filter_bank_parser.add_argument('-r', '--repeat', type=int, default=3, help='Runs per path, the fastest is kept')
+    filter_bank_parser.add_argument('--dtype', default='float64', choices=Data.DTYPES)
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        report = run_benchmarks(args.ftypes, args.num_sampling_points, args.num_time, args.num_repeats,
+                                args.repeat, trace_memory=not args.no_memory, dtype=args.dtype)
+        with open(args.output, 'w') as fp:
+            json.dump(report, fp, indent=2)
+        print('Results written to ', args.output)
+    elif args.command == 'baselines':
+        compare_baselines(args.num_sampling_points, args.num_time, args.num_repeats, args.repeat)
+    elif args.command == 'filter_bank':
+        if compare_filter_bank(args.num_sampling_points, args.num_time, args.num_weights, args.repeat,
+                               dtype=args.dtype) != 0:
+            print('The filter bank differs from separate passes')
+            sys.exit(1)
+    else:
+        with open(args.old, 'r') as fp:
+            old = json.load(fp)
+        with open(args.new, 'r') as fp:
+            new = json.load(fp)
+        regressions = compare(old, new, args.threshold)
+        if regressions:
+            print(f'{len(regressions)} stage(s) slower by more than {args.threshold:.0%}')
+            sys.exit(1)
@@ -0,0 +1,7 @@
+"""Makes the wavey package of src importable whichever directory pytest runs from."""
+import sys
+from os.path import abspath, dirname
+
+SRC_DIR = dirname(dirname(abspath(__file__)))
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
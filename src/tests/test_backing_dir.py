@@ -0,0 +1,25 @@
+"""Data objects sharing a backing_dir keep their own memory mapped arrays."""
+import gc
+
+import numpy as np
+
+from wavey.data import Data
+
+
+def test_shared_backing_dir(tmp_path):
+    x = np.arange(10.)[:, None]
+    ones = np.ones((10, 4))
+    first = Data.from_arrays(x, ones, backing_dir=str(tmp_path))
+    second = Data.from_arrays(x, 2 * ones, backing_dir=str(tmp_path))
+    first.fourier_transform()
+    second.fourier_transform()
+    assert np.all(first.y[:, 0] == 4) and np.all(second.y[:, 0] == 8)
+    assert len(list(tmp_path.iterdir())) == 2
+
+
+def test_backing_files_removed_with_the_data(tmp_path):
+    data = Data.from_arrays(np.arange(10.)[:, None], np.ones((10, 4)), backing_dir=str(tmp_path))
+    assert isinstance(data.y, np.memmap)
+    del data
+    gc.collect()
+    assert list(tmp_path.iterdir()) == []
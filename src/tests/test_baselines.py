@@ -0,0 +1,35 @@
+"""The fast ARPLS paths against the reference ones they replace."""
+import numpy as np
+import pytest
+
+from wavey.baseline_correction import ARPLS
+from wavey.data import Data
+from wavey.synthetic import make_spectra
+
+LAMBDA = 1e5
+STOP_RATIO = 1e-6
+MAX_ITERS = 100
+
+
+def test_banded_solver_matches_sparse():
+    _, y = make_spectra(512, 4, 1)
+    for column in range(y.shape[1]):
+        banded, _, banded_info = ARPLS(LAMBDA, solver='banded').get_baseline(
+            y[:, column], stop_ratio=STOP_RATIO, max_iters=MAX_ITERS, full_output=True)
+        sparse, _, sparse_info = ARPLS(LAMBDA, solver='sparse').get_baseline(
+            y[:, column], stop_ratio=STOP_RATIO, max_iters=MAX_ITERS, full_output=True)
+        assert np.max(np.abs(banded - sparse)) <= 1e-8 * np.max(np.abs(sparse))
+        assert banded_info['num_iters'] == sparse_info['num_iters']
+
+
+@pytest.mark.parametrize('workers', [2, 3])
+def test_parallel_baselines_match_serial(workers):
+    x, y = make_spectra(256, 12, 1)
+    configs = {'lambda': LAMBDA, 'stop_ratio': STOP_RATIO, 'max_iters': MAX_ITERS}
+    serial = Data.from_arrays(x[:, None], y)
+    serial_infos = serial.baseline_correct(Data.BASELINE_ARPLS, dict(configs))
+    parallel = Data.from_arrays(x[:, None], y)
+    parallel_infos = parallel.baseline_correct(Data.BASELINE_ARPLS, dict(configs), workers=workers)
+    assert np.array_equal(serial.baseline, parallel.baseline)
+    assert np.array_equal(serial.y, parallel.y)
+    assert serial_infos == parallel_infos
@@ -0,0 +1,55 @@
+"""Stage cache entries, read memory mapped and evicted by least recent use."""
+import os
+
+import numpy as np
+
+from wavey.cache import StageCache
+from wavey.data import Data
+from wavey.synthetic import write_dataset, write_weights
+
+
+def test_stage_entries_are_memory_mapped(tmp_path):
+    cache = StageCache(str(tmp_path))
+    real = np.arange(12.).reshape(4, 3)
+    cache.put('key', {'real': real, 'imag': -real})
+    cached = cache.get('key')
+    assert isinstance(cached['real'], np.memmap)
+    assert np.array_equal(cached['real'], real) and np.array_equal(cached['imag'], -real)
+    assert cache.get('other') is None
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = StageCache(str(tmp_path))
+    for number, key in enumerate(('old', 'used', 'new')):
+        cache.put(key, {'values': np.zeros(100)})
+        os.utime(cache._entry_path(key), ns=(number * 10 ** 9, number * 10 ** 9))
+    cache.get('old')  # Now the most recently used
+    cache.max_bytes = 2000  # Two of the entries
+    cache.evict()
+    assert cache.get('used') is None
+    assert cache.get('old') is not None and cache.get('new') is not None
+    assert cache.size() <= 2000
+
+
+def test_stage_cache_hit_matches_computed_stages(tmp_path):
+    write_dataset(str(tmp_path / 'spectra'), Data.IR, 128, 12, 2)
+    outputs = []
+    for _ in range(2):
+        data = Data(in_dir=str(tmp_path / 'spectra'), num_time_points=12, ftype=Data.IR,
+                    stage_cache_dir=str(tmp_path / 'stages'), backing_dir=str(tmp_path / 'backing'))
+        data.baseline_correct(Data.BASELINE_SNIP, {'max_half_window': 10})
+        data.fourier_transform()
+        outputs.append((np.array(data.y), np.array(data.phase)))
+    assert np.array_equal(outputs[0][0], outputs[1][0]) and np.array_equal(outputs[0][1], outputs[1][1])
+
+
+def test_plan_weights_a_cached_transform(tmp_path):
+    write_dataset(str(tmp_path / 'spectra'), Data.IR, 128, 12, 2)
+    write_weights(str(tmp_path / 'weights.csv'), 12)
+    outputs = []
+    for _ in range(2):
+        data = Data(in_dir=str(tmp_path / 'spectra'), num_time_points=12, ftype=Data.IR,
+                    stage_cache_dir=str(tmp_path / 'stages'))
+        data.plan().fourier_transform().weight(str(tmp_path / 'weights.csv')).inverse_fourier_transform().execute()
+        outputs.append(np.array(data.y))
+    assert np.array_equal(outputs[0], outputs[1])
@@ -0,0 +1,60 @@
+"""The float32 storage path against the float64 path on synthetic spectra."""
+from os.path import join
+
+import numpy as np
+import pytest
+
+from wavey.data import Data
+from wavey.synthetic import write_dataset, write_weights
+
+NUM_SAMPLING_POINTS = 256
+NUM_TIME_POINTS = 60
+NUM_REPEATS = 2
+BASELINE_CONFIGS = {'lambda': 1e5, 'stop_ratio': 1e-6, 'max_iters': 100}
+# Largest error relative to the largest float64 magnitude of an output
+TOLERANCE = 1e-3
+# The phase of bins holding less than this fraction of the largest magnitude is rounding
+# noise in either precision
+PHASE_MIN_MAGNITUDE = 1e-4
+
+
+def stage_outputs(in_dir: str, weight_fpath: str, ftype: str, dtype: str):
+    """Returns the output of every stage as float64 and the magnitude of the transform."""
+    data = Data(in_dir=in_dir, num_time_points=NUM_TIME_POINTS, ftype=ftype, dtype=dtype)
+    outputs = {'original': data.y.astype(np.float64)}
+    data.baseline_correct(Data.BASELINE_ARPLS, dict(BASELINE_CONFIGS))
+    outputs['baseline_corrected'] = data.y.astype(np.float64)
+    data.fourier_transform()
+    outputs['phase'] = data.phase.astype(np.float64)
+    magnitude = np.hypot(data.y, data.ft_imaginary_component)
+    data.weight(weight_fpath)
+    data.inverse_fourier_transform()
+    outputs['transformed'] = data.y.astype(np.float64)
+    return outputs, magnitude
+
+
+@pytest.mark.parametrize('ftype', [Data.RAMAN, Data.IR, Data.UV_VIS])
+def test_float32_matches_float64(tmp_path, ftype):
+    in_dir = join(tmp_path, 'spectra')
+    write_dataset(in_dir, ftype, NUM_SAMPLING_POINTS, NUM_TIME_POINTS, NUM_REPEATS)
+    weight_fpath = join(tmp_path, 'weights.csv')
+    write_weights(weight_fpath, NUM_TIME_POINTS)
+    reference, magnitude = stage_outputs(in_dir, weight_fpath, ftype, 'float64')
+    single, _ = stage_outputs(in_dir, weight_fpath, ftype, 'float32')
+
+    significant = magnitude >= PHASE_MIN_MAGNITUDE * magnitude.max()
+    for output in reference:
+        difference = single[output] - reference[output]
+        if output == 'phase':
+            # Differences wrap around at +-pi
+            difference = np.angle(np.exp(1j * difference))[significant]
+        error = np.max(np.abs(difference)) / np.max(np.abs(reference[output]))
+        assert error <= TOLERANCE, f'{output} off by {error:.2e}'
+
+
+def test_float32_halves_the_arrays(tmp_path):
+    write_dataset(tmp_path, Data.IR, NUM_SAMPLING_POINTS, NUM_TIME_POINTS, NUM_REPEATS)
+    single = Data(in_dir=str(tmp_path), num_time_points=NUM_TIME_POINTS, ftype=Data.IR, dtype='float32')
+    double = Data(in_dir=str(tmp_path), num_time_points=NUM_TIME_POINTS, ftype=Data.IR, dtype='float64')
+    assert single.y.dtype == np.float32
+    assert single.y.nbytes * 2 == double.y.nbytes
@@ -0,0 +1,55 @@
+"""Import time budgets of the modules the front ends load at startup.
+
+Each module is imported in a fresh interpreter, the fastest of IMPORT_REPEAT imports is
+compared to its budget. Set WAVEY_IMPORT_BUDGET_SCALE to scale every budget, e.g. on
+slow machines.
+"""
+import json
+import os
+from os.path import abspath, dirname
+import subprocess
+import sys
+
+import pytest
+
+SRC_DIR = dirname(dirname(abspath(__file__)))
+# Modules the front ends import at startup and their import time budget in seconds:
+# ui.py imports wavey.constants and wavey.jobs, wavey.py the pipeline
+IMPORT_BUDGETS = {
+    'wavey.constants': 0.05,
+    'wavey.jobs': 0.1,
+    'wavey.pipeline': 0.4,
+    'wavey.data': 0.4,
+}
+# Only imported by the code paths using them, never by importing the modules above
+LAZY_MODULES = ('scipy', 'pandas', 'natsort', 'matplotlib')
+IMPORT_REPEAT = 3
+BUDGET_SCALE = float(os.environ.get('WAVEY_IMPORT_BUDGET_SCALE', 1.0))
+# Run in a fresh interpreter, prints the import time and the lazy modules it loaded
+IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+loaded = sorted({{name.split('.')[0] for name in sys.modules}} & set({lazy_modules!r}))
+print(json.dumps({{'seconds': seconds, 'loaded': loaded}}))
+"""
+
+
+def import_in_subprocess(module: str) -> dict:
+    output = subprocess.run(
+        [sys.executable, '-c', IMPORT_SCRIPT.format(module=module, lazy_modules=LAZY_MODULES)],
+        cwd=SRC_DIR, check=True, capture_output=True, text=True).stdout
+    return json.loads(output)
+
+
+@pytest.mark.parametrize('module', list(IMPORT_BUDGETS))
+def test_import_loads_no_lazy_module(module):
+    assert import_in_subprocess(module)['loaded'] == []
+
+
+@pytest.mark.parametrize('module, budget', list(IMPORT_BUDGETS.items()))
+def test_import_within_budget(module, budget):
+    seconds = min(import_in_subprocess(module)['seconds'] for _ in range(IMPORT_REPEAT))
+    assert seconds <= budget * BUDGET_SCALE, \
+        f'{module} took {seconds * 1e3:.1f} ms, budget {budget * BUDGET_SCALE * 1e3:.1f} ms'
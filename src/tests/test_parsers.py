@@ -0,0 +1,50 @@
+"""The bulk parsers against the rows the original row by row loader kept: rows where x
+or y is not a number are dropped, every other row is read."""
+import numpy as np
+import pytest
+
+from wavey.exceptions import DataError
+from wavey.parsers import IR, RAMAN, UV_VIS, load_spectrum
+
+RAMAN_HEADER = 'Pixel,Wavelength,Raman Shift,Dark,Reference,Dark Subtracted #1'
+
+CASES = {
+    'ir_numeric': (IR, '1000.0,0.5\n1001.5,0.6\n1003.0,-0.7\n',
+                   [1000.0, 1001.5, 1003.0], [0.5, 0.6, -0.7]),
+    'ir_header_and_text_cells': (IR, 'wavenumber,absorbance\n1000.0,0.5\nabc,0.7\n1002.0,n/a\n1004.0,0.9\n',
+                                 [1000.0, 1004.0], [0.5, 0.9]),
+    'ir_short_and_long_rows': (IR, '1000.0,0.5\n1001.0\n1002.0,0.7\n\n1003.0,0.8,extra\n',
+                               [1000.0, 1002.0, 1003.0], [0.5, 0.7, 0.8]),
+    'ir_crlf': (IR, '1000.0,0.5\r\n1001.0,0.6\r\n', [1000.0, 1001.0], [0.5, 0.6]),
+    'raman': (RAMAN, f'File Version,BWSpec4.11_1\nintegration times(ms),1000\n\n{RAMAN_HEADER}\n'
+                     '0,785.0,100.5,1000,0,12.5\n1,785.1,101.5,1000,0,13.5\n',
+              [100.5, 101.5], [12.5, 13.5]),
+    'raman_text_cells_crlf': (RAMAN, f'File Version,BWSpec4.11_1\r\n{RAMAN_HEADER}\r\n'
+                                     '0,785.0,100.5,1000,0,12.5\r\n1,785.1,101.5,1000,0,saturated\r\n'
+                                     '2,785.2,,1000,0,14.5\r\n3,785.3,103.5,1000,0,15.5\r\n',
+                              [100.5, 103.5], [12.5, 15.5]),
+    'uv_vis': (UV_VIS, 'Title\nIntegration time;100\nWavelength;Dark;Reference;Sample;Absorbance\n'
+                       '400.0;0;1;1;0.25\n401.0;0;1;1;0.5\n',
+               [400.0, 401.0], [0.25, 0.5]),
+    'uv_vis_crlf_text_cells_short_rows': (
+        UV_VIS, 'Title\r\nIntegration time;100\r\nWavelength;Dark;Reference;Sample;Absorbance\r\n'
+                '400.0;0;1;1;0.25\r\n401.0;0;1;1;bad\r\n402.0;0;1\r\n403.0;0;1;1;0.5\r\n',
+        [400.0, 403.0], [0.25, 0.5]),
+}
+
+
+@pytest.mark.parametrize('name', list(CASES))
+def test_load_spectrum(tmp_path, name):
+    ftype, text, expected_x, expected_y = CASES[name]
+    fpath = tmp_path / ('spectrum.TXT' if ftype == UV_VIS else 'spectrum.csv')
+    fpath.write_bytes(text.encode())
+    x, y = load_spectrum(str(fpath), ftype)
+    assert x.shape == y.shape == (len(expected_x), 1)
+    assert np.array_equal(x[:, 0], expected_x) and np.array_equal(y[:, 0], expected_y)
+
+
+def test_raman_without_header_raises(tmp_path):
+    fpath = tmp_path / 'spectrum.csv'
+    fpath.write_text('0,785.0,100.5,1000,0,12.5\n')
+    with pytest.raises(DataError):
+        load_spectrum(str(fpath), RAMAN)
@@ -0,0 +1,24 @@
+"""Output formats chosen by the file extension."""
+import numpy as np
+import pytest
+
+from wavey import constants
+from wavey.data import Data
+
+
+def make_data():
+    return Data.from_arrays(np.arange(4.)[:, None], np.ones((4, 3)))
+
+
+def test_unknown_extension_is_written_as_csv(tmp_path):
+    fpath = tmp_path / 'original.txt'
+    make_data().save_to(str(fpath))
+    assert fpath.read_text().splitlines()[1] == '0,0.0,1.0,1.0,1.0'
+
+
+@pytest.mark.skipif(constants.PARQUET_AVAILABLE, reason='a Parquet engine is installed')
+def test_parquet_without_engine_raises(tmp_path):
+    fpath = tmp_path / 'original.parquet'
+    with pytest.raises(ValueError, match='parquet'):
+        make_data().save_to(str(fpath))
+    assert not fpath.exists()
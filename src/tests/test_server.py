@@ -0,0 +1,68 @@
+"""Requests the processing daemon must refuse, it reads and writes any path it is given."""
+import http.client
+import json
+import os
+import stat
+import threading
+
+import pytest
+
+from wavey import server
+
+
+@pytest.fixture
+def tcp_server():
+    running = server.make_server('127.0.0.1:0')
+    thread = threading.Thread(target=running.serve_forever, daemon=True)
+    thread.start()
+    yield running
+    running.shutdown()
+    running.server_close()
+
+
+def post(running, body: str, headers: dict) -> int:
+    connection = http.client.HTTPConnection(*running.server_address[:2])
+    try:
+        connection.request('POST', '/plan', body=body, headers=headers)
+        return connection.getresponse().status
+    finally:
+        connection.close()
+
+
+# VALID stands for the token of the server
+@pytest.mark.parametrize('headers', [
+    {'Content-Type': 'text/plain', server.TOKEN_HEADER: 'VALID'},  # A "simple" request of a web page
+    {'Content-Type': 'application/json', server.TOKEN_HEADER: 'VALID', 'Origin': 'http://example.com'},
+    {'Content-Type': 'application/json', server.TOKEN_HEADER: 'VALID', 'Host': 'example.com:8765'},
+    {'Content-Type': 'application/json', server.TOKEN_HEADER: 'wrong'},
+    {'Content-Type': 'application/json'},
+])
+def test_refuses_untrusted_requests(tcp_server, tmp_path, headers):
+    fpath = tmp_path / 'overwritten.txt'
+    body = json.dumps({'configs': {}, 'steps': [['save_to', {'fpath': str(fpath)}]]})
+    headers = {name: tcp_server.token if value == 'VALID' else value for name, value in headers.items()}
+    assert post(tcp_server, body, headers) in (403, 415)
+    assert not fpath.exists()
+
+
+def test_accepts_requests_with_the_token(tcp_server):
+    address = '127.0.0.1:{}'.format(tcp_server.server_address[1])
+    reply = server.request(address, 'GET', '/status', token=tcp_server.token)
+    assert reply['datasets'] == []
+    with pytest.raises(server.DataError):
+        server.request(address, 'GET', '/status', token='wrong')
+
+
+def test_unix_socket_and_token_are_private(tmp_path):
+    address = str(tmp_path / 'server.sock')
+    running = server.make_server(address)
+    try:
+        server.write_token(server.token_path(address), running.token)
+        assert stat.S_IMODE(os.stat(address).st_mode) & 0o077 == 0
+        assert stat.S_IMODE(os.stat(server.token_path(address)).st_mode) == 0o600
+        thread = threading.Thread(target=running.serve_forever, daemon=True)
+        thread.start()
+        assert server.request(address, 'GET', '/status')['datasets'] == []
+        running.shutdown()
+    finally:
+        running.server_close()
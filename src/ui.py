@@ -17,51 +17,65 @@ __project__ = "MES wavey"
 __date__ = "May 04, 2023"
 
 # built-in modules
-from os import makedirs
-from os.path import join, exists
+from os.path import basename, exists, normpath
 import tkinter as tk
 from tkinter.ttk import Progressbar
 from tkinter import filedialog
-import threading as th
 # third-party modules
 
 
 # project modules
-from wavey.data import Data
+from wavey import constants
+from wavey.jobs import DONE, FAILED, FINISHED, QUEUED, JobEngine
 
-'''Data types from Data class'''
-RAMAN = Data.RAMAN
-IR = Data.IR
-UV_VIS = Data.UV_VIS
+'''Data types, the same as those of the Data class'''
+RAMAN = constants.RAMAN
+IR = constants.IR
+UV_VIS = constants.UV_VIS
+
+'''Baseline correction methods, the same as those of the Data class, and the configs the UI runs them with'''
+BASELINE_METHODS = constants.BASELINE_METHODS
+BASELINE_CORRECTION_CONFIGS = constants.BASELINE_DEFAULT_CONFIGS
+
+'''Output formats, the same as those of the Data class'''
+CSV = constants.CSV
+OUTPUT_FORMATS = constants.OUTPUT_FORMATS
 
 
 '''Create a window'''
 window = tk.Tk()
 window.title("Wavey")
-window.geometry("500x500")
-
-def make_progress_bar():
-    '''Create a window for progress bar'''
-    progress_bar_window = tk.Toplevel(window)
-    progress_bar_window.title("Progress Bar")
-    progress_bar_window.geometry("300x100")
-    progress_bar_window.withdraw()
-    '''progress bar'''
-    progress_bar = Progressbar(progress_bar_window, orient="horizontal", length=200, mode="determinate",takefocus=True,maximum=100)
-    progress_bar.pack()
-    '''create a label for the progress bar'''
-    progress_bar_label = tk.Label(progress_bar_window, text="Progress")
-    progress_bar_label.pack()
-    return progress_bar_window, progress_bar
-
-def update_progress_bar(progress_bar, progress):
-    '''Update the progress bar'''
-    progress_bar['value'] = progress
-    progress_bar.update()
-
-def remove_progress_bar(progress_bar_window):
-    '''Remove the progress bar'''
-    progress_bar_window.destroy()
+window.geometry("600x800")
+
+'''Experiments run on worker threads of the job engine, at most MAX_CONCURRENT_JOBS at a time'''
+MAX_CONCURRENT_JOBS = 2
+'''Milliseconds between two polls of the job events'''
+POLL_INTERVAL_MS = 100
+engine = JobEngine(max_concurrent=MAX_CONCURRENT_JOBS)
+'''job id -> (label, progress bar, cancel button) of every submitted job'''
+job_rows = {}
+
+'''Share of the progress bar (start, end) filled by each stage, the rest is saving'''
+STAGE_PROGRESS = {
+    'load': (0, 40),
+    'baseline_correct': (40, 70),
+    'fourier_transform': (70, 80),
+    'weight': (80, 85),
+    'inverse_fourier_transform': (85, 95),
+}
+
+def stage_progress(event):
+    '''Returns the progress bar value of a stage event, None for stages without a share'''
+    '''fused stages are named after their parts, joined by +'''
+    parts = [STAGE_PROGRESS[part] for part in event['stage'].split('+') if part in STAGE_PROGRESS]
+    if not parts:
+        return None
+    stage_start, stage_end = min(part[0] for part in parts), max(part[1] for part in parts)
+    if event['event'] == 'stage_start':
+        return stage_start
+    elif event['event'] == 'progress':
+        return stage_start + (stage_end - stage_start) * event['done'] / event['total']
+    return stage_end
 
 '''Propogate error to user'''
 def error_window(error):
@@ -73,9 +87,39 @@ def error_window(error):
     error_label.pack()
     error_window.deiconify()
 
+def add_job_row(job_id, configs):
+    '''Shows a submitted job with its progress bar and a button to cancel it'''
+    row = tk.Frame(jobs_frame)
+    label = tk.Label(row, text=f"#{job_id} {basename(normpath(configs['spectrum_dir']))}: {QUEUED}", width=30, anchor="w")
+    label.pack(side=tk.LEFT)
+    progress_bar = Progressbar(row, orient="horizontal", length=150, mode="determinate", maximum=100)
+    progress_bar.pack(side=tk.LEFT)
+    cancel_button = tk.Button(row, text="Cancel", command=lambda: engine.cancel(job_id))
+    cancel_button.pack(side=tk.LEFT)
+    row.pack()
+    job_rows[job_id] = (label, progress_bar, cancel_button)
+
+def poll_jobs():
+    '''Applies the events of the job engine to the job rows, on the Tk thread'''
+    for event in engine.drain():
+        label, progress_bar, cancel_button = job_rows[event['job_id']]
+        if event['event'] == 'status':
+            label.config(text=label.cget("text").rsplit(": ", 1)[0] + ": " + event['status'])
+            if event['status'] == DONE:
+                progress_bar['value'] = 100
+            if event['status'] in FINISHED:
+                cancel_button.config(state=tk.DISABLED)
+            if event['status'] == FAILED:
+                error_window(event['error'] + " \nThis is most likely due to an incorrect input or selected file. \nPlease check your inputs and try again. Also make sure you do not have the files open in another program like Excel.")
+        else:
+            progress = stage_progress(event)
+            if progress is not None:
+                progress_bar['value'] = progress
+    window.after(POLL_INTERVAL_MS, poll_jobs)
+
 '''create a button to run the program'''
 
-def run(
+def make_configs(
         in_dir: str,
         out_dir:str,
         num_time_points: int,
@@ -83,79 +127,60 @@ def run(
         weight_file:str="",
         start: int=0,
         end: int=-1,
-        ftype: str=RAMAN
+        ftype: str=RAMAN,
+        output_format: str=CSV,
+        x_min: float=None,
+        x_max: float=None,
+        bin_width: float=None,
+        baseline_warm_start: bool=False,
+        cache_dir: str=""
     ):
-
+    '''Builds the wavey.py configuration of the inputs'''
+    return {
+        'spectrum_dir': in_dir,
+        'out_dir': out_dir,
+        'number_of_time_points': num_time_points,
+        'start_frame': start,
+        'end_frame': end,
+        'spectra_type': ftype,
+        'weight_file': weight_file if exists(weight_file) else None,
+        'baseline_correction_method': None if baseline_correction_method == "None" else baseline_correction_method,
+        'baseline_correction_configs': BASELINE_CORRECTION_CONFIGS.get(baseline_correction_method.lower()),
+        'baseline_warm_start': baseline_warm_start,
+        'cache_dir': cache_dir if exists(cache_dir) else None,
+        'output_format': output_format,
+        'x_min': x_min,
+        'x_max': x_max,
+        'bin_width': bin_width,
+    }
+
+'''queue the run on the job engine, the Tk thread only polls its events'''
+def run_cmd(**inputs):
+    configs = make_configs(**inputs)
     try:
-        if baseline_correction_method.lower() == "arpls":
-            baseline_correction_configs = {
-                'lambda':  100000,
-                'stop_ratio': .000001, 
-                'max_iters': 10000
-            }
-
-        ''' add async to the run function to make it run in the background'''
-        progress_bar_window, progress_bar = make_progress_bar()
-        progress_bar_window.deiconify()
-        makedirs(out_dir, exist_ok=True)
-        update_progress_bar(progress_bar, 10)
-        original_data_fpath = join(out_dir, 'original_data.csv')
-        transformed_data_fpath = join(out_dir, 'transformed_data.csv')
-        phase_data_fpath = join(out_dir, 'phase_data.csv')
-        spectral_data = Data(in_dir=in_dir, num_time_points=num_time_points, start=start, end=end,ftype=ftype)
-        update_progress_bar(progress_bar, 25)
-        print('Saving original data to ', original_data_fpath)
-        spectral_data.save_to(original_data_fpath)
-
-        if baseline_correction_method != "None":
-            spectral_data.baseline_correct(
-                method=baseline_correction_method, 
-                configs=baseline_correction_configs)
-            baseline_corrected_data_fpath = join(out_dir, 'baseline_corrected_data.csv')
-            print('Saving baseline corrected data to ', baseline_corrected_data_fpath)
-            spectral_data.save_to(baseline_corrected_data_fpath)
-        update_progress_bar(progress_bar, 45)
-        spectral_data.fourier_transform()
-        update_progress_bar(progress_bar, 60)
-        if exists(weight_file):
-            spectral_data.weight(fpath=weight_file)
-        
-        spectral_data.save_phase_to(fpath=phase_data_fpath)
-        update_progress_bar(progress_bar, 75)
-        spectral_data.inverse_fourier_transform()
-        update_progress_bar(progress_bar, 95)
-        print('Saving transformed data to ', transformed_data_fpath)
-        spectral_data.save_to(transformed_data_fpath)
-        update_progress_bar(progress_bar, 100)
-        remove_progress_bar(progress_bar_window)
-    except Exception as e:
-        error_window(str(e)+ " \nThis is most likely due to an incorrect input or selected file. \nPlease check your inputs and try again. Also make sure you do not have the files open in another program like Excel.")
-
-'''threading the run command'''
-def thread_run_cmd(
-        in_dir: str,
-        out_dir:str,
-        num_time_points: int,
-        baseline_correction_method:str="",
-        weight_file:str="",
-        start: int=0,
-        end: int=-1,
-        ftype: str=RAMAN
-    ):
-        t1 = th.Thread(target=run, args=(in_dir, out_dir, num_time_points, baseline_correction_method, weight_file, start, end, ftype))
-        t1.start()
+        job_id = engine.submit(configs)
+    except ValueError as e:
+        error_window(str(e))
+        return
+    add_job_row(job_id, configs)
 
 run_button = tk.Button(
     window,
     text="Run",
-    command=lambda: thread_run_cmd(in_dir=text_diplay_input_dir.cget("text"),
+    command=lambda: run_cmd(in_dir=text_diplay_input_dir.cget("text"),
         out_dir=text_diplay_output_dir.cget("text"),
         num_time_points=int(num_time_points.get()),
         baseline_correction_method=baseline_correction_method.get(),
         weight_file=text_diplay_wf.cget("text"),
         start=int(start.get()),
         end=int(end.get()),
-        ftype=ftype.get())
+        ftype=ftype.get(),
+        output_format=output_format.get(),
+        x_min=optional_float(x_min.get()),
+        x_max=optional_float(x_max.get()),
+        bin_width=optional_float(bin_width.get()),
+        baseline_warm_start=baseline_warm_start.get(),
+        cache_dir=text_diplay_cache_dir.cget("text"))
 )
 
 def remove_run_button():
@@ -204,6 +229,17 @@ text_diplay_wf.pack()
 open_file_button = tk.Button(window, text="Weight File", command=open_file_weighting)
 open_file_button.pack()
 
+'''create a button to choose a directory to cache parsed spectra in, nothing is cached without one'''
+
+text_diplay_cache_dir = tk.Label(window, text="No Cache Directory Chosen", font=("Arial", 12))
+def open_dir_cache():
+    dir_path = tk.filedialog.askdirectory()
+    cache_dir = dir_path
+    text_diplay_cache_dir.config(text=cache_dir)
+text_diplay_cache_dir.pack()
+cache_dir_button = tk.Button(window, text="Cache Directory (Optional)", font=("Arial", 12), command=open_dir_cache)
+cache_dir_button.pack()
+
 '''create an input for the number of time points'''
 
 num_time_points = tk.Entry(window)
@@ -228,6 +264,27 @@ label = tk.Label(window, text="End Frame", font=("Arial", 12))
 label.pack()
 end.pack()
 
+'''create inputs for the region of interest, left empty to keep every point'''
+
+def optional_float(text):
+    '''Empty entries are None'''
+    return float(text) if text.strip() else None
+
+x_min = tk.Entry(window)
+label = tk.Label(window, text="X Min", font=("Arial", 12))
+label.pack()
+x_min.pack()
+
+x_max = tk.Entry(window)
+label = tk.Label(window, text="X Max", font=("Arial", 12))
+label.pack()
+x_max.pack()
+
+bin_width = tk.Entry(window)
+label = tk.Label(window, text="Bin Width", font=("Arial", 12))
+label.pack()
+bin_width.pack()
+
 '''create an enumeration for the baseline correction method'''
 
 baseline_correction_method = tk.StringVar(window)
@@ -235,7 +292,14 @@ baseline_correction_method.set("None") # default value
 label = tk.Label(window, text="Baseline Correction Method")
 label.pack()
 #TODO: make linked variables for the baseline correction method
-w = tk.OptionMenu(window, baseline_correction_method, "None", "arpls") #, "polynomial")
+w = tk.OptionMenu(window, baseline_correction_method, "None", *BASELINE_METHODS) #, "polynomial")
+w.pack()
+
+'''create a checkbox for warm starting the ARPLS baselines, off by default'''
+
+baseline_warm_start = tk.BooleanVar(window)
+baseline_warm_start.set(False) # default value
+w = tk.Checkbutton(window, text="Warm Start Baselines (ARPLS)", variable=baseline_warm_start)
 w.pack()
 
 '''create an enumeration for the file type'''
@@ -248,6 +312,28 @@ ftype.set(RAMAN) # default value
 w = tk.OptionMenu(window, ftype, RAMAN, UV_VIS, IR)
 w.pack()
 
+'''create an enumeration for the output format'''
+
+output_format = tk.StringVar(window)
+label = tk.Label(window, text="Output Format")
+label.pack()
+output_format.set(CSV) # default value
+
+w = tk.OptionMenu(window, output_format, *OUTPUT_FORMATS)
+w.pack()
+
 '''Add run button to window'''
 pack_run_button()
+
+'''Running and finished jobs are listed below the run button'''
+jobs_frame = tk.Frame(window)
+jobs_frame.pack()
+
+def on_close():
+    '''Cancels the unfinished jobs before closing'''
+    engine.shutdown(cancel=True)
+    window.destroy()
+
+window.protocol("WM_DELETE_WINDOW", on_close)
+window.after(POLL_INTERVAL_MS, poll_jobs)
 window.mainloop()
@@ -1,50 +1,59 @@
 from argparse import ArgumentParser
-from os import makedirs
 from os.path import join
 
 import yaml
 
-from src.wavey.data import Data
+from src.wavey.batch import jobs_from_configs, jobs_from_glob, run_batch
+from src.wavey.pipeline import run
+from src.wavey.server import DEFAULT_ADDRESS, DEFAULT_POOL_MEGABYTES, serve, submit
+from src.wavey.watch import watch
 
 if __name__ == '__main__':
     parser = ArgumentParser()
-    parser.add_argument('config_fpath')
+    parser.add_argument('config_fpath', nargs='*',
+                        help='YAML configuration, several files are processed as a batch')
+    parser.add_argument('--watch', action='store_true',
+                        help='Keep watching spectrum_dir and update the outputs after every complete period')
+    parser.add_argument('--poll_interval', type=float, default=1.0,
+                        help='Seconds between two scans of spectrum_dir in watch mode')
+    parser.add_argument('--spectrum_glob',
+                        help='Batch mode: process every directory matching this pattern with the settings '
+                             'of the configuration, writing to a sub directory of its out_dir per experiment')
+    parser.add_argument('--workers', type=int, default=1, help='Batch mode: number of worker processes')
+    parser.add_argument('--manifest', help='Batch mode: path of the JSON summary, also used to resume a batch')
+    parser.add_argument('--no_resume', action='store_true',
+                        help='Batch mode: rerun jobs the manifest lists as successful')
+    parser.add_argument('--serve', nargs='?', const=DEFAULT_ADDRESS,
+                        help=f'Run the processing daemon on a Unix socket path, {DEFAULT_ADDRESS} by default, or on '
+                             'host:port (localhost only), keeping loaded datasets in memory between requests. '
+                             'Clients authenticate with the token it writes next to the socket')
+    parser.add_argument('--pool_megabytes', type=float, default=DEFAULT_POOL_MEGABYTES,
+                        help='Daemon: memory above which the least recently used datasets are dropped')
+    parser.add_argument('--server', help='Process the configuration on the daemon at this address instead')
     args = parser.parse_args()
-    with open(args.config_fpath, 'r') as fp:
-        configs = yaml.safe_load(fp)
-    
-    spectrum_dir = configs['spectrum_dir']
-    weight_file = configs.get('weight_file')
-    num_time_points = int(configs.get('number_of_time_points'))
-    baseline_correction_method = configs.get('baseline_correction_method', None)
-    baseline_correction_configs = configs.get('baseline_correction_configs')
-    start_frame = configs.get('start_frame')
-    end_frame = configs.get('end_frame')
-    file_type = configs.get('spectra_type')
-    out_dir = configs['out_dir']
-    makedirs(out_dir, exist_ok=True)
-    
-    original_data_fpath = join(out_dir, 'original_data.csv')
-    transformed_data_fpath = join(out_dir, 'transformed_data.csv')
-    phase_data_fpath = join(out_dir, 'phase_data.csv')
-
-    spectral_data = Data(in_dir=spectrum_dir, num_time_points=num_time_points, start=start_frame, end=end_frame,ftype=file_type)
-    print('Saving original data to ', original_data_fpath)
-    spectral_data.save_to(original_data_fpath)
-
-    if baseline_correction_method is not None:
-        spectral_data.baseline_correct(
-            method=baseline_correction_method, 
-            configs=baseline_correction_configs)
-        baseline_corrected_data_fpath = join(out_dir, 'baseline_corrected_data.csv')
-        print('Saving baseline corrected data to ', baseline_corrected_data_fpath)
-        spectral_data.save_to(baseline_corrected_data_fpath)
-
-    spectral_data.fourier_transform()
-    if weight_file is not None:
-        spectral_data.weight(fpath=weight_file)
-    spectral_data.save_phase_to(fpath=phase_data_fpath)
-    spectral_data.inverse_fourier_transform()
-    print('Saving transformed data to ', transformed_data_fpath)
-    spectral_data.save_to(transformed_data_fpath)
+    if not args.config_fpath and args.serve is None:
+        parser.error('a configuration is required unless running the daemon with --serve')
 
+    if args.serve is not None:
+        serve(args.serve, pool_max_bytes=int(args.pool_megabytes * 1024 ** 2))
+    elif args.spectrum_glob is not None or len(args.config_fpath) > 1:
+        if args.spectrum_glob is not None:
+            template = jobs_from_configs(args.config_fpath[:1])[0]
+            jobs = jobs_from_glob(template, args.spectrum_glob)
+            manifest_fpath = args.manifest or join(template['out_dir'], 'batch_manifest.json')
+        else:
+            jobs = jobs_from_configs(args.config_fpath)
+            manifest_fpath = args.manifest or 'batch_manifest.json'
+        manifest = run_batch(jobs, manifest_fpath, workers=args.workers, resume=not args.no_resume)
+        print(f"{manifest['summary']['num_ok']} of {manifest['summary']['num_jobs']} jobs succeeded, "
+              f"see {manifest_fpath}")
+    else:
+        with open(args.config_fpath[0], 'r') as fp:
+            configs = yaml.safe_load(fp)
+        if args.watch:
+            watch(configs, poll_interval=args.poll_interval)
+        elif args.server is not None:
+            for name, fpath in submit(configs, args.server).items():
+                print(f'{name}: {fpath}')
+        else:
+            run(configs)
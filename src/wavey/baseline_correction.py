@@ -1,8 +1,29 @@
 """Baseline correction"""
+from functools import lru_cache
+
 import numpy as np
 from numpy.linalg import norm
-from scipy import sparse
-from scipy.sparse import linalg
+
+# scipy is imported where it is used, it is only needed once a baseline is computed
+
+
+@lru_cache(maxsize=32)
+def _penalty_bands(L: int, lambda_: float) -> np.ndarray:
+    """Returns H = lambda * D * D^T in upper banded storage, shape (3, L).
+
+    H only depends on the spectrum length and lambda, so it is built once and shared
+    by every spectrum of a dataset. The returned array is read-only.
+    """
+    from scipy import sparse
+    diag = np.ones(L - 2)
+    D = sparse.spdiags([diag, -2*diag, diag], [0, -1, -2], L, L - 2)
+    H = lambda_ * D.dot(D.T)  # The transposes are flipped w.r.t the Algorithm on pg. 252
+    bands = np.zeros((3, L))
+    bands[0, 2:] = H.diagonal(2)
+    bands[1, 1:] = H.diagonal(1)
+    bands[2, :] = H.diagonal(0)
+    bands.flags.writeable = False
+    return bands
 
 
 class ARPLS:
@@ -14,42 +35,190 @@ class ARPLS:
         Analyst 140, 250–257 (2014).
   
     """
-    def __init__(self, lambda_: float) -> None:
+    BANDED = 'banded'
+    SPARSE = 'sparse'
+
+    def __init__(self, lambda_: float, solver: str='banded') -> None:
+        """
+        Args:
+            lambda_: smoothness penalty.
+            solver: 'banded' solves the pentadiagonal system W + H with a banded Cholesky
+                factorization, 'sparse' uses the general sparse LU solver of the original
+                implementation.
+        """
+        if solver not in (self.BANDED, self.SPARSE):
+            raise ValueError(f'solver {solver} not recognized')
         self.lambda_ = lambda_
+        self.solver = solver
     
-    def get_baseline(self, y: np.ndarray, stop_ratio: float=1e-6, max_iters: int=10, full_output=False)-> np.ndarray:
+    def get_baseline(self, y: np.ndarray, stop_ratio: float=1e-6, max_iters: int=10, full_output=False,
+                     w0: np.ndarray=None)-> np.ndarray:
+        """
+        Args:
+            y: spectrum.
+            stop_ratio: the iterations stop when the relative change of the weights drops
+                below it.
+            max_iters: maximum number of iterations.
+            full_output: also return the residual y - z and an info dict with num_iters,
+                final_ratio, converged, restarted and the final weights.
+            w0: initial weights, e.g. the converged weights of a similar spectrum, instead
+                of uniform ones. When the iterations started from w0 diverge, i.e. produce
+                non-finite values or end up changing the weights more than the first
+                iteration did, the spectrum is solved again from uniform weights. That sets
+                restarted and num_iters counts both attempts.
+        """
         L = len(y)
-        diag = np.ones(L - 2)
-        D = sparse.spdiags([diag, -2*diag, diag], [0, -1, -2], L, L - 2)
-        H = self.lambda_ * D.dot(D.T)  # The transposes are flipped w.r.t the Algorithm on pg. 252
-        w = np.ones(L)
-        W = sparse.spdiags(w, 0, L, L)
+        if self.solver == self.BANDED:
+            from scipy.linalg import solveh_banded
+            H_bands = _penalty_bands(L, float(self.lambda_))
+            WH_bands = H_bands.copy()
+            def solve(w):
+                WH_bands[2] = H_bands[2] + w
+                return solveh_banded(WH_bands, w * y, check_finite=False)
+        else:
+            from scipy import sparse
+            from scipy.sparse import linalg
+            diag = np.ones(L - 2)
+            D = sparse.spdiags([diag, -2*diag, diag], [0, -1, -2], L, L - 2)
+            H = self.lambda_ * D.dot(D.T)  # The transposes are flipped w.r.t the Algorithm on pg. 252
+            W = sparse.spdiags(np.ones(L), 0, L, L)
+            def solve(w):
+                W.setdiag(w)  # Do not create a new matrix, just update diagonal values
+                return linalg.spsolve(W + H, W * y)
+
+        num_iters = 0
+        restarted = False
+        if w0 is not None:
+            z, d, w, current_ratio, attempt_iters, first_ratio = self._iterate(
+                solve, y, np.array(w0, dtype=np.float64), stop_ratio, max_iters)
+            num_iters += attempt_iters
+            # Diverged: non-finite, or the weights change more at the end than at the start
+            restarted = not (np.all(np.isfinite(z))
+                             and (current_ratio <= stop_ratio or current_ratio < first_ratio))
+        if w0 is None or restarted:
+            z, d, w, current_ratio, attempt_iters, _ = self._iterate(solve, y, np.ones(L), stop_ratio, max_iters)
+            num_iters += attempt_iters
+        if attempt_iters > max_iters:
+            print('Maximum number of iterations exceeded')
+        converged = current_ratio <= stop_ratio
 
+        if full_output:
+            info = {'num_iters': num_iters, 'final_ratio': current_ratio, 'converged': converged,
+                    'restarted': restarted, 'weights': w}
+            return z, d, info
+        else:
+            return z
+
+    @staticmethod
+    def _iterate(solve, y: np.ndarray, w: np.ndarray, stop_ratio: float, max_iters: int):
         current_ratio = 1
+        first_ratio = None
         num_iters = 0
         while current_ratio > stop_ratio:
-            z = linalg.spsolve(W + H, W * y)
+            z = solve(w)
             d = y - z
             dn = d[d < 0]
             m = np.mean(dn)
             s = np.std(dn)
             w_new = 1 / (1 + np.exp(2 * (d - (2*s - m))/s))
             current_ratio = norm(w_new - w) / norm(w)
+            if first_ratio is None:
+                first_ratio = current_ratio
             w = w_new
-            W.setdiag(w)  # Do not create a new matrix, just update diagonal values
             
             num_iters += 1
             if num_iters > max_iters:
-                print('Maximum number of iterations exceeded')
                 break
-
-        if full_output:
-            info = {'num_iters': num_iters, 'final_ratio': current_ratio}
-            return z, d, info
-        else:
-            return z
+        return z, d, w, current_ratio, num_iters, first_ratio
     
 
+def _smooth(Y: np.ndarray, half_window: int) -> np.ndarray:
+    """Moving average over 2 * half_window + 1 points along the columns of Y."""
+    from scipy.ndimage import uniform_filter1d
+    Y = np.asarray(Y, dtype=np.float64)
+    if half_window <= 0:
+        return Y
+    return uniform_filter1d(Y, 2 * half_window + 1, axis=0, mode='nearest')
+
+
+class SNIP:
+    """Statistics-sensitive non-linear iterative peak-clipping [1].
+
+    Every point is repeatedly replaced by the smaller of itself and the mean of its two
+    neighbours k points away, for k = 1 ... max_half_window, which clips away peaks
+    narrower than about 2 * max_half_window points. The clipping is done on all spectra
+    (columns) at once.
+
+    References
+    [1]: Ryan, C. G., Clayton, E., Griffin, W. L., Sie, S. H. & Cousens, D. R.
+        SNIP, a statistics-sensitive background treatment for the quantitative analysis
+        of PIXE spectra in geoscience applications. Nucl. Instrum. Methods B 34, 396-402 (1988).
+    """
+
+    def __init__(self, max_half_window: int=40, decreasing: bool=False, smooth_half_window: int=5) -> None:
+        """
+        Args:
+            max_half_window: largest clipping distance in points, about half the width of
+                the widest peak.
+            decreasing: clip from the largest distance down to 1, which follows curved
+                baselines more closely.
+            smooth_half_window: half width of a moving average applied to the spectra
+                before clipping. Clipping follows the lower edge of the noise, smoothing
+                first keeps the baseline from being pulled down by it. 0 to skip it.
+        """
+        if max_half_window < 1:
+            raise ValueError(f'max_half_window must be at least 1, got {max_half_window}')
+        self.max_half_window = int(max_half_window)
+        self.decreasing = decreasing
+        self.smooth_half_window = int(smooth_half_window)
+
+    def get_baselines(self, Y: np.ndarray) -> np.ndarray:
+        """Returns the baselines of the spectra in the columns of Y."""
+        baseline = np.array(_smooth(Y, self.smooth_half_window), dtype=np.float64)
+        num_points = baseline.shape[0]
+        half_windows = range(1, min(self.max_half_window, (num_points - 1) // 2) + 1)
+        if self.decreasing:
+            half_windows = reversed(half_windows)
+        for k in half_windows:
+            neighbour_mean = (baseline[:-2 * k] + baseline[2 * k:]) / 2
+            np.minimum(baseline[k:-k], neighbour_mean, out=baseline[k:-k])
+        return baseline
+
+    def get_baseline(self, y: np.ndarray) -> np.ndarray:
+        return self.get_baselines(y[:, None])[:, 0]
+
+
+class RollingBall:
+    """Morphological (rolling ball) baseline.
+
+    A grey opening, a moving minimum followed by a moving maximum over 2 * half_window + 1
+    points, gives the lower envelope a flat structuring element traces under the
+    spectrum. All spectra (columns) are filtered at once.
+    """
+
+    def __init__(self, half_window: int=40, smooth_half_window: int=5) -> None:
+        """
+        Args:
+            half_window: half the width of the structuring element in points, larger
+                than half the width of the widest peak.
+            smooth_half_window: half width of a moving average applied to the spectra
+                before the opening, see SNIP. 0 to skip it.
+        """
+        if half_window < 1:
+            raise ValueError(f'half_window must be at least 1, got {half_window}')
+        self.half_window = int(half_window)
+        self.smooth_half_window = int(smooth_half_window)
+
+    def get_baselines(self, Y: np.ndarray) -> np.ndarray:
+        """Returns the baselines of the spectra in the columns of Y."""
+        from scipy.ndimage import grey_opening
+        return grey_opening(_smooth(Y, self.smooth_half_window), size=(2 * self.half_window + 1, 1),
+                            mode='nearest')
+
+    def get_baseline(self, y: np.ndarray) -> np.ndarray:
+        return self.get_baselines(y[:, None])[:, 0]
+
+
 if __name__ == '__main__':
     import matplotlib.pyplot as plt
     from scipy.signal import savgol_filter
@@ -0,0 +1,154 @@
+"""Runs the wavey.py pipeline over many experiments in a process pool."""
+from __future__ import annotations
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from glob import glob
+import json
+import os
+from os.path import abspath, basename, exists, isdir, join, normpath
+import time
+import traceback
+from typing import Dict, List
+
+import yaml
+
+from wavey import pipeline
+
+OK = 'ok'
+FAILED = 'failed'
+CRASHED = 'crashed'
+# Attempts of a job whose worker process died before it reported back
+MAX_ATTEMPTS = 2
+
+
+def jobs_from_configs(config_fpaths: List[str]) -> List[dict]:
+    """One job per wavey.py YAML configuration file."""
+    jobs = []
+    for config_fpath in config_fpaths:
+        with open(config_fpath, 'r') as fp:
+            jobs.append(yaml.safe_load(fp))
+    return jobs
+
+
+def jobs_from_glob(template: dict, spectrum_glob: str) -> List[dict]:
+    """One job per directory matching spectrum_glob, with the settings of template.
+
+    The outputs of each experiment go to a sub directory of the template out_dir named
+    after the experiment directory.
+    """
+    jobs = []
+    import natsort
+    for spectrum_dir in natsort.natsorted(glob(spectrum_glob)):
+        if not isdir(spectrum_dir):
+            continue
+        jobs.append(dict(template, spectrum_dir=spectrum_dir,
+                         out_dir=join(template['out_dir'], basename(normpath(spectrum_dir)))))
+    return jobs
+
+
+def job_id(configs: dict) -> str:
+    """Jobs are identified by their output directory, no two jobs may write to the same one."""
+    return abspath(configs['out_dir'])
+
+
+def _run_job(configs: dict) -> dict:
+    started = time.time()
+    record = {
+        'spectrum_dir': configs.get('spectrum_dir'),
+        'out_dir': configs.get('out_dir'),
+        'started': datetime.fromtimestamp(started).isoformat(timespec='seconds'),
+    }
+    try:
+        record['outputs'] = pipeline.run(configs)
+        record['status'] = OK
+    except Exception as e:
+        record['status'] = FAILED
+        record['error'] = f'{type(e).__name__}: {e}'
+        record['traceback'] = traceback.format_exc()
+    record['seconds'] = time.time() - started
+    return record
+
+
+def _write_manifest(manifest: dict, manifest_fpath: str) -> None:
+    tmp_fpath = f'{manifest_fpath}.tmp'
+    with open(tmp_fpath, 'w') as fp:
+        json.dump(manifest, fp, indent=2)
+    os.replace(tmp_fpath, manifest_fpath)
+
+
+def run_batch(jobs: List[dict], manifest_fpath: str, workers: int=1, resume: bool=True) -> dict:
+    """Runs every job through pipeline.run in a pool of worker processes.
+
+    Workers are reused across jobs, so the interpreter start up and imports are paid once
+    per worker. An exception in a job only fails that job. The manifest is rewritten after
+    every finished job with its status, error, timing and output paths. When a worker
+    process dies, which job killed it is unknown, so the unfinished jobs are run one at a
+    time in a fresh single worker pool until the job that kills its worker is found. Only
+    that job is retried, and marked as crashed after MAX_ATTEMPTS. With resume, jobs
+    the manifest already lists as successful are skipped, so a batch that was interrupted
+    continues with the remaining jobs when it is started again.
+
+    Returns:
+        the manifest, {'jobs': {job_id: record}, ...}.
+    """
+    manifest = {'jobs': {}}
+    if resume and exists(manifest_fpath):
+        with open(manifest_fpath, 'r') as fp:
+            manifest = json.load(fp)
+    pending: Dict[str, dict] = {}
+    for configs in jobs:
+        jid = job_id(configs)
+        if jid in pending:
+            raise ValueError(f'More than one job writes to {jid}')
+        if manifest['jobs'].get(jid, {}).get('status') != OK:
+            pending[jid] = configs
+    print(f'{len(pending)} of {len(jobs)} jobs to run')
+
+    attempts = {jid: 0 for jid in pending}
+    # After a worker died, jobs run one per fresh pool until the job that killed it is found
+    isolate = False
+    batch_started = time.time()
+    while pending:
+        if isolate:
+            isolated_jid = next(iter(pending))
+            batch = {isolated_jid: pending[isolated_jid]}
+        else:
+            batch = dict(pending)
+        try:
+            with ProcessPoolExecutor(max_workers=1 if isolate else workers) as executor:
+                futures = {executor.submit(_run_job, configs): jid for jid, configs in batch.items()}
+                for future in as_completed(futures):
+                    jid = futures[future]
+                    manifest['jobs'][jid] = future.result()
+                    del pending[jid]
+                    print(f"{manifest['jobs'][jid]['status']}: {jid}")
+                    _write_manifest(manifest, manifest_fpath)
+        except BrokenProcessPool:
+            if not isolate:
+                isolate = True
+                continue
+            # The job ran alone, so it killed its worker
+            attempts[isolated_jid] += 1
+            if attempts[isolated_jid] >= MAX_ATTEMPTS:
+                manifest['jobs'][isolated_jid] = {
+                    'spectrum_dir': pending[isolated_jid].get('spectrum_dir'),
+                    'out_dir': pending[isolated_jid].get('out_dir'),
+                    'status': CRASHED,
+                    'error': 'The worker process terminated abruptly',
+                }
+                del pending[isolated_jid]
+                print(f'{CRASHED}: {isolated_jid}')
+                # Found it, the remaining jobs share a pool again
+                isolate = False
+            _write_manifest(manifest, manifest_fpath)
+
+    records = manifest['jobs'].values()
+    manifest['summary'] = {
+        'num_jobs': len(manifest['jobs']),
+        'num_ok': sum(record['status'] == OK for record in records),
+        'num_failed': sum(record['status'] != OK for record in records),
+        'seconds': time.time() - batch_started,
+    }
+    _write_manifest(manifest, manifest_fpath)
+    return manifest
@@ -0,0 +1,194 @@
+"""On disk caches of parsed spectrum files and of stage outputs."""
+from __future__ import annotations
+import hashlib
+import json
+import os
+from os.path import abspath, isdir, join
+import shutil
+from typing import Callable, Dict, List, Optional, Tuple
+import uuid
+
+import numpy as np
+
+from wavey.parsers import Region, load_spectrum
+
+DEFAULT_MAX_BYTES = 1024 ** 3
+# Bump when the parsers change what they return for the same file
+CACHE_VERSION = 1
+# Bump when a cached stage changes what it computes for the same inputs
+STAGE_CACHE_VERSION = 2
+
+
+def file_signatures(fpaths: List[str]) -> List[Tuple[str, int, int]]:
+    """(absolute path, size, modification time) of every file, which changes when a file
+    is edited or replaced."""
+    signatures = []
+    for fpath in fpaths:
+        stat = os.stat(fpath)
+        signatures.append((abspath(fpath), stat.st_size, stat.st_mtime_ns))
+    return signatures
+
+
+class _LeastRecentlyUsedDirectory:
+    """Directory of cache entries, files or directories of files, evicted by least
+    recent use.
+
+    Reading an entry updates its modification time, so the oldest modification time
+    belongs to the least recently used entry.
+    """
+    SUFFIX = None
+
+    def __init__(self, cache_dir: str, max_bytes: int=DEFAULT_MAX_BYTES) -> None:
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _entries(self) -> List[Tuple[int, int, str]]:
+        """(modification time, size, path) of every entry."""
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith(self.SUFFIX):
+                continue
+            try:
+                if entry.is_dir():
+                    size = sum(member.stat().st_size for member in os.scandir(entry.path))
+                else:
+                    size = entry.stat().st_size
+                entries.append((entry.stat().st_mtime_ns, size, entry.path))
+            except FileNotFoundError:
+                pass  # Removed by another process meanwhile
+        return entries
+
+    @staticmethod
+    def _remove(entry_path: str) -> None:
+        if isdir(entry_path):
+            shutil.rmtree(entry_path, ignore_errors=True)
+        else:
+            try:
+                os.remove(entry_path)
+            except FileNotFoundError:
+                pass
+
+    @staticmethod
+    def _touch(entry_path: str) -> None:
+        """Marks an entry as recently used."""
+        try:
+            os.utime(entry_path)
+        except FileNotFoundError:
+            pass  # Evicted by another process since, the loaded entry is still valid
+
+    @staticmethod
+    def _write_entry(entry_path: str, write: Callable[[str], None]) -> None:
+        """Writes an entry with write(path) next to entry_path and renames it, so
+        concurrent readers never see a partial entry."""
+        tmp_path = f'{entry_path}.{uuid.uuid4().hex}.tmp'
+        write(tmp_path)
+        try:
+            os.replace(tmp_path, entry_path)
+        except OSError:
+            if not isdir(entry_path):
+                raise
+            # A directory entry of the same key, stored by another process meanwhile
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    def evict(self) -> None:
+        """Removes the least recently used entries until the cache fits in max_bytes."""
+        entries = self._entries()
+        total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            self._remove(path)
+            total_bytes -= size
+
+    def clear(self) -> None:
+        for _, _, path in self._entries():
+            self._remove(path)
+
+    def size(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+
+class SpectrumCache(_LeastRecentlyUsedDirectory):
+    """Stores the parsed (x, y) arrays of spectrum files as .npy files.
+
+    Entries are keyed by the absolute path, size, modification time and file type of the
+    source file, so an edited or replaced file is parsed again, and by the region of
+    interest the spectrum was reduced to. When the cache grows above
+    max_bytes the least recently used entries are removed.
+    """
+    SUFFIX = '.npy'
+
+    def _entry_path(self, fpath: str, ftype: str, region: Region=None) -> str:
+        stat = os.stat(fpath)
+        key = f'{CACHE_VERSION}|{abspath(fpath)}|{stat.st_size}|{stat.st_mtime_ns}|{ftype.lower()}'
+        if region is not None and not region.is_full():
+            key += f'|{region.key()}'
+        return join(self.cache_dir, hashlib.sha1(key.encode()).hexdigest() + self.SUFFIX)
+
+    def get(self, fpath: str, ftype: str, region: Region=None) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        entry_path = self._entry_path(fpath, ftype, region)
+        try:
+            xy = np.load(entry_path)
+        except (OSError, ValueError):
+            return None
+        self._touch(entry_path)
+        return xy[:, :1].copy(), xy[:, 1:].copy()
+
+    def put(self, fpath: str, ftype: str, x: np.ndarray, y: np.ndarray, region: Region=None) -> None:
+        def write(path: str) -> None:
+            with open(path, 'wb') as fp:
+                np.save(fp, np.concatenate((x, y), axis=-1))
+        self._write_entry(self._entry_path(fpath, ftype, region), write)
+
+    def load(self, fpath: str, ftype: str, region: Region=None) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns the cached arrays of fpath, parsing and storing them on a miss."""
+        cached = self.get(fpath, ftype, region)
+        if cached is not None:
+            return cached
+        x, y = load_spectrum(fpath=fpath, ftype=ftype, region=region)
+        self.put(fpath, ftype, x, y, region)
+        return x, y
+
+
+class StageCache(_LeastRecentlyUsedDirectory):
+    """Stores the named output arrays of processing stages as directories of .npy files,
+    which are read memory mapped so cached stages of large datasets need not fit in RAM.
+
+    Entries are content addressed: the key of a stage output is a hash of the key of
+    its input and of the stage parameters, see key. Chaining the keys from the input
+    files onwards means an entry is only found again when the files and every
+    parameter up to that stage are unchanged. When the cache grows above max_bytes the
+    least recently used entries are removed.
+    """
+    SUFFIX = '.stage'
+
+    @staticmethod
+    def key(*parts) -> str:
+        """Hash of parts, JSON serializable values such as the key of the input stage
+        and the stage parameters."""
+        text = json.dumps([STAGE_CACHE_VERSION, *parts], sort_keys=True, default=str)
+        return hashlib.sha1(text.encode()).hexdigest()
+
+    def _entry_path(self, key: str) -> str:
+        return join(self.cache_dir, key + self.SUFFIX)
+
+    def get(self, key: str) -> Optional[Dict[str, np.ndarray]]:
+        """Returns the arrays stored under key as read only memory maps, None on a miss."""
+        entry_path = self._entry_path(key)
+        try:
+            arrays = {name[:-len('.npy')]: np.load(join(entry_path, name), mmap_mode='r')
+                      for name in os.listdir(entry_path) if name.endswith('.npy')}
+        except (OSError, ValueError):
+            return None
+        self._touch(entry_path)
+        return arrays
+
+    def put(self, key: str, arrays: Dict[str, np.ndarray]) -> None:
+        """Stores the arrays under key and evicts what no longer fits."""
+        def write(path: str) -> None:
+            os.makedirs(path)
+            for name, values in arrays.items():
+                np.save(join(path, f'{name}.npy'), values)
+        self._write_entry(self._entry_path(key), write)
+        self.evict()
@@ -0,0 +1,43 @@
+"""Names shared by the processing modules and the front ends.
+
+Only plain values, so ui.py and other front ends can import them without loading numpy
+and the rest of the processing stack.
+"""
+from importlib.util import find_spec
+
+# Spectrum file types
+RAMAN = 'raman'
+UV_VIS = 'uv'
+IR = 'ir'
+
+# Storage types of the spectra
+DTYPES = ('float64', 'float32')
+
+# Baseline correction methods, ARPLS solves every column on its own, the others filter
+# the whole matrix at once
+BASELINE_ARPLS = 'arpls'
+BASELINE_SNIP = 'snip'
+BASELINE_ROLLING_BALL = 'rolling_ball'
+BASELINE_METHODS = (BASELINE_ARPLS, BASELINE_SNIP, BASELINE_ROLLING_BALL)
+# Parameters of every method and the values used when none are given
+BASELINE_DEFAULT_CONFIGS = {
+    BASELINE_ARPLS: {'lambda': 100000, 'stop_ratio': .000001, 'max_iters': 10000},
+    BASELINE_SNIP: {'max_half_window': 40, 'smooth_half_window': 5},
+    BASELINE_ROLLING_BALL: {'half_window': 40, 'smooth_half_window': 5},
+}
+BASELINE_CONFIG_KEYS = {
+    BASELINE_ARPLS: ('lambda', 'stop_ratio', 'max_iters'),
+    BASELINE_SNIP: ('max_half_window', 'decreasing', 'smooth_half_window'),
+    BASELINE_ROLLING_BALL: ('half_window', 'smooth_half_window'),
+}
+
+# Output file formats
+CSV = 'csv'
+NPY = 'npy'
+NPZ = 'npz'
+PARQUET = 'parquet'
+# Parquet is written by pandas through one of these, it is offered only when one is
+# installed. find_spec locates them without importing them
+PARQUET_ENGINES = ('pyarrow', 'fastparquet')
+PARQUET_AVAILABLE = any(find_spec(engine) is not None for engine in PARQUET_ENGINES)
+OUTPUT_FORMATS = (CSV, NPY, NPZ, PARQUET) if PARQUET_AVAILABLE else (CSV, NPY, NPZ)
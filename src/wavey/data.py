@@ -1,26 +1,73 @@
 from __future__ import annotations
-from copy import deepcopy
-import csv
 from glob import glob
-from os.path import join
-from typing import Tuple
+from os import makedirs
+from os.path import join, splitext
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from collections import deque
+from functools import partial
+from itertools import islice
+import shutil
+import tempfile
+import threading
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
 import numpy as np
-from scipy.fft import fft, ifft
-import pandas as pd
-import math
 import warnings
-import natsort
+import weakref
 
-from wavey.baseline_correction import ARPLS
-from wavey.exceptions import DataError
+from wavey.baseline_correction import ARPLS, SNIP, RollingBall
+from wavey.cache import DEFAULT_MAX_BYTES, SpectrumCache, StageCache, file_signatures
+from wavey import constants
+from wavey.exceptions import CancelledError, DataError
+from wavey.instrumentation import NULL_INSTRUMENTATION, Instrumentation
+from wavey.parallel import parallel_baselines
+from wavey.plan import Plan
+from wavey.repeats import add_squared_deviations, variance_from_squared_deviations
+from wavey import parsers
+from wavey.parsers import Region, load_spectrum, load_weights
+
+# scipy.fft, pandas and natsort are imported by the methods using them, so importing
+# wavey and building the UI does not wait for them
 
 class Data:
 
-    RAMAN = 'raman'
-    UV_VIS = 'uv'
-    IR = 'ir'
+    RAMAN = constants.RAMAN
+    UV_VIS = constants.UV_VIS
+    IR = constants.IR
+
+    THREAD = 'thread'
+    PROCESS = 'process'
+    # Files parsed ahead of the assembly per load worker
+    LOAD_WINDOW_PER_WORKER = 2
+    DEFAULT_CHUNK_ROWS = 4096
+    DTYPES = constants.DTYPES
+    # Baseline correction methods, ARPLS solves every column on its own, the others
+    # filter the whole matrix at once
+    BASELINE_ARPLS = constants.BASELINE_ARPLS
+    BASELINE_SNIP = constants.BASELINE_SNIP
+    BASELINE_ROLLING_BALL = constants.BASELINE_ROLLING_BALL
+    BASELINE_METHODS = constants.BASELINE_METHODS
+    BASELINE_CONFIG_KEYS = constants.BASELINE_CONFIG_KEYS
+
+    CSV = constants.CSV
+    NPY = constants.NPY
+    NPZ = constants.NPZ
+    PARQUET = constants.PARQUET
+    OUTPUT_FORMATS = constants.OUTPUT_FORMATS
+    PARQUET_ENGINES = constants.PARQUET_ENGINES
+    # Rows per chunk of the CSV writer when no chunk_rows is set
+    CSV_CHUNK_ROWS = 10000
+    # Per column info of the ARPLS baselines, kept with them in the stage cache
+    BASELINE_INFO_KEYS = ('num_iters', 'final_ratio', 'converged', 'restarted')
 
-    def __init__(self, in_dir: str, num_time_points: int, start: int=0, end: int=-1, ftype: str='raman') -> Data:
+    def __init__(self, in_dir: str, num_time_points: int, start: int=0, end: int=-1, ftype: str='raman',
+                 load_workers: int=1, load_executor: str='thread',
+                 progress_callback: Callable[[int, int, str], None]=None,
+                 cache_dir: str=None, cache_max_bytes: int=DEFAULT_MAX_BYTES,
+                 backing_dir: str=None, chunk_rows: int=None,
+                 instrumentation: Instrumentation=None, dtype: str='float64',
+                 x_range: Tuple[float, float]=None, bin_width: float=None, decimation: int=None,
+                 cancel_event: threading.Event=None, repeat_statistics: bool=False,
+                 stage_cache_dir: str=None, stage_cache_max_bytes: int=DEFAULT_MAX_BYTES) -> Data:
         """
         Data structure to hold the spectrum. The data is stored in the form of x containing 
         wavenumbers or raman shifts of shape (num_sampling_points, 1) and y containing the 
@@ -29,14 +76,57 @@ class Data:
         Note:
             The responses are averaged across a third axis of length num_repitions calculated as:
             total_num_files // num_time_points.
+
+        Args:
+            load_workers: number of files read and parsed concurrently. Files are always
+                assembled in natsort order, whatever order they finish in.
+            load_executor: 'thread' or 'process' pool used when load_workers > 1.
+            progress_callback: called as progress_callback(num_loaded, num_files, fpath)
+                after each file is assembled.
+            cache_dir: directory of the parsed spectrum cache. When given, files that are
+                unchanged since they were last parsed are read from the cache instead.
+            cache_max_bytes: size above which least recently used cache entries are evicted.
+            backing_dir: when given, y, the baseline, the imaginary component and the phase
+                are kept in memory mapped .npy files in a sub directory of their own in this
+                directory instead of RAM, and every stage works through them in chunks. The
+                sub directory is removed with the object, so objects and processes can share
+                a backing_dir.
+            chunk_rows: number of rows (sampling points) processed at a time. Defaults to
+                all rows in memory and to DEFAULT_CHUNK_ROWS with a backing_dir.
+            instrumentation: receives the timing, memory and progress of every stage, see
+                wavey.instrumentation. Disabled by default.
+            dtype: 'float64' or 'float32' storage of y and of the arrays derived from it.
+                float32 halves the memory at about 7 significant digits. x is always
+                float64. The baseline, imaginary component and phase arrays are only
+                allocated when a stage or a caller first uses them.
+            x_range: (x_min, x_max) of the region of interest, either can be None. Points
+                outside of it are dropped while parsing, so they are never stored or
+                processed, and the cache stores the reduced spectra.
+            bin_width: average the points of the region into bins of this width in x units.
+            decimation: average the points of the region in groups of this many, as an
+                alternative to bin_width.
+            cancel_event: when set, e.g. from another thread, loading and the following
+                baseline corrections and plans stop at the next file, column or chunk
+                with a CancelledError.
+            repeat_statistics: also compute the variance and standard error of every point
+                across the repetitions, in the same pass over the files and without
+                keeping the individual repetitions. Needs memory for one more matrix.
+            stage_cache_dir: directory of the stage output cache. When given, the averaged
+                matrix, the baselines and the forward Fourier transform are stored there
+                and read back instead of being computed again when the input files and
+                every parameter up to that stage are unchanged, see wavey.cache.StageCache.
+                Modifying y directly in between is not tracked.
+            stage_cache_max_bytes: size above which least recently used stage outputs are
+                evicted.
         """
         self.num_time_points = num_time_points
-        if ftype.lower() == self.RAMAN or ftype.lower() == self.IR:
-            all_files = natsort.natsorted(glob(join(in_dir, '*.csv')))
-        elif ftype.lower() == self.UV_VIS:
-            all_files = natsort.natsorted(glob(join(in_dir, '*.TXT')))
-        else:
-            raise Exception(f"The file type {ftype} is not supported.")
+        self._instrumentation = instrumentation or NULL_INSTRUMENTATION
+        self._cancel_event = cancel_event
+        self._setup_storage(backing_dir=backing_dir, chunk_rows=chunk_rows, dtype=dtype)
+        self._cache = None if cache_dir is None else SpectrumCache(cache_dir, max_bytes=cache_max_bytes)
+        x_min, x_max = (None, None) if x_range is None else x_range
+        self._region = Region(x_min=x_min, x_max=x_max, bin_width=bin_width, decimation=decimation)
+        all_files = self.list_files(in_dir, ftype)
         if end == -1:
             all_files_sliced = all_files[start:]
         elif end > len(all_files):
@@ -49,40 +139,141 @@ class Data:
             )
         
         num_repeats = len(all_files_sliced) // num_time_points
+        if num_repeats == 0:
+            raise DataError(f'Found {len(all_files_sliced)} files, fewer than the {num_time_points} time points')
+        # Files of an incomplete last repetition are not part of the average
+        all_files_used = all_files_sliced[:num_repeats * num_time_points]
+        self.num_repeats = num_repeats
+        self._stage_cache = None
+        self._stage_key = None
+        if stage_cache_dir is not None:
+            self._stage_cache = StageCache(stage_cache_dir, max_bytes=stage_cache_max_bytes)
+            self._stage_key = self._stage_cache.key(
+                'load', file_signatures(all_files_used), ftype.lower(), num_time_points, self._region.key(),
+                self.dtype.str, repeat_statistics)
         self._x, self._y = None, None
-        full_y = None
-        time_point = 0
-        for fpath in all_files_sliced: # tqdm(all_files_sliced): # tqdm is a progress bar not suitable for GUI implementation
-            x, y = self._load_data(fpath=fpath, ftype=ftype)
-
-            if time_point == 0 or time_point == num_time_points:
-                full_y = y
-                if self._x is None:
-                    self._x = x
-                time_point = 0
-            
+        self._auxiliary: Dict[str, np.ndarray] = {}
+        squared_deviations = None
+        with self._instrumentation.stage('load'):
+            cached = self._get_stage(self._stage_key)
+            if cached is not None:
+                self._x = np.array(cached['x'])
+                self._y = self._allocate('y', cached['y'].shape)
+                self._y[:] = cached['y']
+                if 'variance' in cached:
+                    self._auxiliary_array('variance')[:] = cached['variance']
+                self._instrumentation.progress(len(all_files_used), len(all_files_used))
             else:
-                if self._x.shape != x.shape:
-                    raise DataError('Different x-axis size between files')
-                if full_y.shape[0] != y.shape[0]:
-                    raise DataError(f'Different y-axis length between files. '
-                                    f'Current length {self.full_y.shape[0]} but got {y.shape[0]} for file {fpath}')
-                full_y = np.concatenate((full_y, y), axis=-1)
-            
-            if full_y.shape[-1] == num_time_points:
-                if self._y is None:
-                    self._y = full_y
-                else:
-                    self._y += full_y
-                full_y = None
-
-            time_point += 1
-        
-        self._y /= num_repeats
-        self._init_data = (deepcopy(self._x), deepcopy(self._y))
-        self._baseline = np.zeros_like(self._y)
-        self._ft_imaginary_component = np.zeros_like(self._y)
-        self._phase = np.zeros_like(self._y)
+                loaded = self._iter_loaded(all_files_used, ftype=ftype, workers=load_workers, executor=load_executor)
+                for file_id, (fpath, (x, y)) in enumerate(loaded):
+                    self._check_cancelled()
+                    if self._y is None:
+                        if x.shape[0] == 0:
+                            raise DataError(f'No sampling points of {fpath} in x_range {x_range}')
+                        self._x = x
+                        # Single accumulator, every file is added into its time point column
+                        self._y = self._allocate('y', (x.shape[0], num_time_points))
+                        if repeat_statistics:
+                            squared_deviations = self._allocate('variance', self._y.shape)
+                    elif self._x.shape != x.shape:
+                        raise DataError('Different x-axis size between files')
+                    if self._y.shape[0] != y.shape[0]:
+                        raise DataError(f'Different y-axis length between files. '
+                                        f'Current length {self._y.shape[0]} but got {y.shape[0]} for file {fpath}')
+                    time_point = file_id % num_time_points
+                    if squared_deviations is not None:
+                        # Before the file is added, the column holds the sum of the earlier repetitions
+                        add_squared_deviations(squared_deviations[:, time_point], self._y[:, time_point],
+                                               file_id // num_time_points + 1, y[:, 0])
+                    self._y[:, time_point] += y[:, 0]
+                    self._instrumentation.count('files_parsed')
+                    self._instrumentation.progress(file_id + 1, len(all_files_used))
+                    if progress_callback is not None:
+                        progress_callback(file_id + 1, len(all_files_used), fpath)
+                self._y /= num_repeats
+                outputs = {'x': self._x, 'y': self._y}
+                if squared_deviations is not None:
+                    variance_from_squared_deviations(squared_deviations, num_repeats)
+                    self._auxiliary['variance'] = outputs['variance'] = squared_deviations
+                self._put_stage(self._stage_key, **outputs)
+        if self._cache is not None:
+            self._cache.evict()
+
+    @classmethod
+    def from_arrays(cls, x: np.ndarray, y: np.ndarray, backing_dir: str=None, chunk_rows: int=None,
+                    instrumentation: Instrumentation=None, dtype: str='float64',
+                    cancel_event: threading.Event=None, variance: np.ndarray=None,
+                    num_repeats: int=None) -> Data:
+        """Builds Data from already averaged responses instead of a directory of files.
+
+        Args:
+            x: wavenumbers or raman shifts of shape (num_sampling_points, 1).
+            y: responses of shape (num_sampling_points, num_time_points), copied.
+            variance: variance of y across the repetitions, of the shape of y, copied.
+            num_repeats: number of repetitions y is the average of.
+        """
+        data = cls.__new__(cls)
+        data.num_time_points = y.shape[-1]
+        data.num_repeats = num_repeats
+        data._stage_cache = None
+        data._stage_key = None
+        data._instrumentation = instrumentation or NULL_INSTRUMENTATION
+        data._cancel_event = cancel_event
+        data._setup_storage(backing_dir=backing_dir, chunk_rows=chunk_rows, dtype=dtype)
+        data._cache = None
+        data._x = np.array(x, dtype=np.float64).reshape((-1, 1))
+        data._y = data._allocate('y', y.shape)
+        data._y[:] = y
+        data._auxiliary = {}
+        if variance is not None:
+            if variance.shape != y.shape:
+                raise DataError(f'Variance of shape {variance.shape} does not match y of shape {y.shape}')
+            if num_repeats is None:
+                raise DataError('The number of repetitions is needed with the variance')
+            data._auxiliary_array('variance')[:] = variance
+        return data
+
+    def copy(self) -> Data:
+        """Returns an in memory copy of x, y and the arrays filled so far, e.g. to process a
+        loaded dataset several times. The copy keeps the stage cache and the number of
+        repetitions, not the instrumentation or the cancel event."""
+        data = Data.from_arrays(self._x, self._y, chunk_rows=self.chunk_rows, dtype=self.dtype.name,
+                                num_repeats=self.num_repeats)
+        for name, array in self._auxiliary.items():
+            data._auxiliary_array(name)[:] = array
+        data._stage_cache = self._stage_cache
+        data._stage_key = self._stage_key
+        return data
+
+    @classmethod
+    def list_files(cls, in_dir: str, ftype: str) -> List[str]:
+        """Returns the spectrum files of in_dir in natsort order."""
+        try:
+            pattern = parsers.FILE_PATTERNS[ftype.lower()]
+        except KeyError:
+            raise Exception(f"The file type {ftype} is not supported.")
+        import natsort
+        return natsort.natsorted(glob(join(in_dir, pattern)))
+
+    def _setup_storage(self, backing_dir: str, chunk_rows: int, dtype: str) -> None:
+        if np.dtype(dtype).name not in self.DTYPES:
+            raise ValueError(f'dtype {dtype} not supported, use one of {self.DTYPES}')
+        self.dtype = np.dtype(dtype)
+        self._backing_dir = None
+        if backing_dir is not None:
+            makedirs(backing_dir, exist_ok=True)
+            self._backing_dir = tempfile.mkdtemp(prefix='data_', dir=backing_dir)
+            # Removed once the object is garbage collected, arrays still mapped keep their data
+            weakref.finalize(self, shutil.rmtree, self._backing_dir, ignore_errors=True)
+        if chunk_rows is None and backing_dir is not None:
+            chunk_rows = self.DEFAULT_CHUNK_ROWS
+        self.chunk_rows = chunk_rows
+
+    def _auxiliary_array(self, name: str) -> np.ndarray:
+        """Returns the array name filled by a later stage, allocated on first use."""
+        if name not in self._auxiliary:
+            self._auxiliary[name] = self._allocate(name, self._y.shape)
+        return self._auxiliary[name]
     
     @property
     def x(self):
@@ -94,143 +285,518 @@ class Data:
     
     @property
     def baseline(self):
-        return self._baseline
+        return self._auxiliary_array('baseline')
     
     @property
     def ft_imaginary_component(self):
-        return self._ft_imaginary_component
+        return self._auxiliary_array('ft_imaginary_component')
     
     @property
     def phase(self):
-        return self._phase
+        return self._auxiliary_array('phase')
+
+    @property
+    def variance(self):
+        """Sample variance of the original y across the repetitions, NaN for a single one."""
+        if 'variance' not in self._auxiliary:
+            raise DataError('No repetition statistics, load the data with repeat_statistics=True')
+        return self._auxiliary['variance']
+
+    @property
+    def standard_error(self):
+        """Standard error of the mean of the original y, sqrt(variance / num_repeats)."""
+        if 'standard_error' not in self._auxiliary:
+            variance = self.variance
+            standard_error = self._auxiliary_array('standard_error')
+            for rows in self._row_chunks():
+                standard_error[rows] = np.sqrt(variance[rows] / self.num_repeats)
+        return self._auxiliary['standard_error']
+
+    def _allocate(self, name: str, shape: Tuple[int, int]) -> np.ndarray:
+        """Returns a zero filled matrix, memory mapped to name.npy in the directory of this
+        object when there is a backing_dir."""
+        if self._backing_dir is None:
+            return np.zeros(shape, dtype=self.dtype)
+        return np.lib.format.open_memmap(join(self._backing_dir, f'{name}.npy'), mode='w+',
+                                         dtype=self.dtype, shape=shape)
+
+    def _row_chunks(self) -> Iterator[slice]:
+        num_rows = self._y.shape[0]
+        step = num_rows if self.chunk_rows is None else self.chunk_rows
+        for start in range(0, num_rows, max(step, 1)):
+            yield slice(start, min(start + step, num_rows))
+
+    def _column_chunks(self) -> Iterator[slice]:
+        """Column blocks holding about as many values as a chunk of chunk_rows rows."""
+        num_rows, num_columns = self._y.shape
+        if self.chunk_rows is None:
+            step = num_columns
+        else:
+            step = max(1, self.chunk_rows * num_columns // max(num_rows, 1))
+        for start in range(0, num_columns, step):
+            yield slice(start, min(start + step, num_columns))
+
+    def flush(self) -> None:
+        """Writes memory mapped arrays back to their files."""
+        for array in (self._y, *self._auxiliary.values()):
+            if isinstance(array, np.memmap):
+                array.flush()
+
+    def _check_cancelled(self) -> None:
+        """Cancellation point, raises CancelledError once the cancel event is set."""
+        if self._cancel_event is not None and self._cancel_event.is_set():
+            raise CancelledError('Processing was cancelled')
+
+    def _get_stage(self, key: str) -> Optional[Dict[str, np.ndarray]]:
+        """Returns the cached outputs of the stage with key, None on a miss or without a cache."""
+        if self._stage_cache is None or key is None:
+            return None
+        cached = self._stage_cache.get(key)
+        if cached is not None:
+            self._instrumentation.count('stage_cache_hits')
+        return cached
+
+    def _put_stage(self, key: str, **arrays: np.ndarray) -> None:
+        if self._stage_cache is not None and key is not None:
+            self._stage_cache.put(key, arrays)
+
+    def _stage_key_of(self, *parameters) -> Optional[str]:
+        """Key of the output of a stage with parameters applied to the current y, None when
+        y is not tracked by the stage cache."""
+        if self._stage_cache is None or self._stage_key is None:
+            return None
+        return self._stage_cache.key(self._stage_key, *parameters)
 
     def _load_data(self, fpath: str, ftype: str) -> Tuple[np.ndarray, np.ndarray]:
         """Loads data from the file."""
-        if ftype.lower() == self.RAMAN:
-            x_name = 'Raman Shift'
-            x_col = -1
-            y_name = 'Dark Subtracted #1'
-            y_col = -1
-            useful_data_start = False
-            data = {'x': [], 'y': []}
-            with open(fpath, newline='') as csvfile:
-                reader = csv.reader(csvfile, delimiter=',')
-                for row in reader:
-                    if useful_data_start:
-                        assert x_col != -1 and y_col != -1
-                        try:
-                            y_val = float(row[y_col])
-                        except ValueError as e:
-                            print(type(e))
-                            y_val = np.nan
-                        data['y'].append(y_val)
-                        
-                        try:
-                            x_val = float(row[x_col])
-                        except ValueError as e:
-                            x_val = np.nan
-                        data['x'].append(x_val)
-
-                    if x_name in row:
-                        useful_data_start = True
-                        x_col = row.index(x_name)
-                        y_col = row.index(y_name)
-        elif ftype.lower() == self.IR:
-            x_col = 0
-            y_col = 1
-            useful_data_start = True
-            data = {'x': [], 'y': []}
-            with open(fpath, newline='') as csvfile:
-                reader = csv.reader(csvfile, delimiter=',')
-                for row in reader:
-                    if useful_data_start:
-                        assert x_col != -1 and y_col != -1
-                        try:
-                            y_val = float(row[y_col])
-                        except ValueError as e:
-                            print(type(e))
-                            y_val = np.nan
-                        data['y'].append(y_val)
-                        
-                        try:
-                            x_val = float(row[x_col])
-                        except ValueError as e:
-                            x_val = np.nan
-                        data['x'].append(x_val)
-                        
-        elif ftype.lower() == self.UV_VIS:
-            data = {'x': [], 'y': []}
-            with open(fpath,'r') as f:
-                column_labels = []
-                for line in f:
-                    split_line = line.replace("\n","").split(';')
-                    if len(split_line) == 5:
-                        if len(column_labels) == 0:
-                            column_labels = split_line
-                        else:
-                            try:
-                                y_val = float(split_line[-1])
-                            except ValueError as e:
-                                y_val = np.nan
-                            data['y'].append(y_val)
-                            try:
-                                x_val = float(split_line[0])
-                            except ValueError as e:
-                                x_val = np.nan
-                            data['x'].append(x_val)
+        if self._cache is not None:
+            return self._cache.load(fpath=fpath, ftype=ftype, region=self._region)
+        return load_spectrum(fpath=fpath, ftype=ftype, region=self._region)
+
+    def _iter_loaded(self, fpaths: List[str], ftype: str, workers: int=1,
+                     executor: str='thread') -> Iterator[Tuple[str, Tuple[np.ndarray, np.ndarray]]]:
+        """Yields (fpath, (x, y)) for every file, in the order of fpaths.
+
+        With workers > 1 the files are parsed in a thread or process pool. The results are
+        taken in submission order, so the assembly order never changes. At most
+        LOAD_WINDOW_PER_WORKER * workers files are parsed ahead of the caller, so only a few
+        parsed spectra are held at a time. Files that have not started parsing are dropped
+        when the caller stops early.
+        """
+        if workers <= 1:
+            for fpath in fpaths: # tqdm(all_files_sliced): # tqdm is a progress bar not suitable for GUI implementation
+                yield fpath, self._load_data(fpath=fpath, ftype=ftype)
+            return
+        if executor == self.THREAD:
+            pool = ThreadPoolExecutor(max_workers=workers)
+            load = partial(self._load_data, ftype=ftype)
+        elif executor == self.PROCESS:
+            pool = ProcessPoolExecutor(max_workers=workers)
+            load = partial(load_spectrum if self._cache is None else self._cache.load, ftype=ftype,
+                           region=self._region)
         else:
-            raise NotImplementedError(f'{ftype} ftype not supported')
+            raise ValueError(f'executor {executor} not recognized')
+        with pool:
+            in_flight = deque()
+            remaining = iter(fpaths)
+            try:
+                for fpath in islice(remaining, self.LOAD_WINDOW_PER_WORKER * workers):
+                    in_flight.append((fpath, pool.submit(load, fpath)))
+                while in_flight:
+                    fpath, future = in_flight.popleft()
+                    result = future.result()
+                    # Dropped before it is yielded, the caller holds the only reference
+                    del future
+                    for next_fpath in islice(remaining, 1):
+                        in_flight.append((next_fpath, pool.submit(load, next_fpath)))
+                    yield fpath, result
+                    del result
+            finally:
+                for _, future in in_flight:
+                    future.cancel()
 
-        data_df = pd.DataFrame(data).dropna()
-        return data_df['x'].values.reshape((-1, 1)), data_df['y'].values.reshape((-1, 1))
+    def plan(self) -> Plan:
+        """Returns an empty Plan, the stages declared on it run fused when it is executed."""
+        return Plan(self)
 
+    def fourier_transform(self, workers: int=None, real_input: bool=False):
+        """Fourier transforms every row (frequency [cm-1] in the spectra) along the time axis.
 
-    def fourier_transform(self):
-        # FT is performed for each row (frequency [cm-1] in the spectra)
-        for row in range(self._y.shape[0]):
-            fourier_transformed_data = fft(self._y[row])
-            self._y[row] = np.real(fourier_transformed_data)
-            self._ft_imaginary_component[row] = np.imag(fourier_transformed_data)
-            # Phase data will be in radians
-            self._phase[row] = np.array(
-                [math.atan2(re,im) for re, im in zip(self._y[row],self._ft_imaginary_component[row])]
-            )
+        Args:
+            workers: number of threads used by scipy.fft. Defaults to scipy's default (1).
+                Negative values wrap around os.cpu_count().
+            real_input: use the real-input transform (rfft) and rebuild the negative
+                frequencies from the Hermitian symmetry of the spectrum.
+        """
+        with self._instrumentation.stage('fourier_transform'):
+            # Computed rows go straight into y and the imaginary component
+            forward = self._forward_stage(workers, real_input, out=(self._y, self.ft_imaginary_component))
+            for rows in self._row_chunks():
+                real, imag = forward(rows)
+                if forward.cached is not None:
+                    self._y[rows] = real
+                    self.ft_imaginary_component[rows] = imag
+                self.phase[rows] = self._phase(real, imag)
+                self._instrumentation.progress(rows.stop, self._y.shape[0])
+            forward.store()
+        self._stage_key = forward.key
         return self
+
+    def _forward_transform(self, block: np.ndarray, workers: int=None,
+                           real_input: bool=False) -> Tuple[np.ndarray, np.ndarray]:
+        """Real and imaginary parts of the Fourier transform of block along the time axis,
+        see fourier_transform."""
+        from scipy.fft import fft, rfft
+        if real_input:
+            transformed = self._full_spectrum_from_rfft(rfft(block, axis=-1, workers=workers), block.shape[-1])
+        else:
+            transformed = fft(block, axis=-1, workers=workers)
+        return transformed.real, transformed.imag
+
+    @staticmethod
+    def _phase(real: np.ndarray, imag: np.ndarray) -> np.ndarray:
+        """Phase of a transform, in radians."""
+        return np.arctan2(real, imag)
+
+    def _forward_stage(self, workers: int=None, real_input: bool=False,
+                       out: Tuple[np.ndarray, np.ndarray]=None) -> _ForwardStage:
+        """The forward transform of the current y through the stage cache, see _ForwardStage."""
+        return _ForwardStage(self, workers=workers, real_input=real_input, out=out)
+
+    @staticmethod
+    def _fourier_transform_parameters(real_input: bool) -> Tuple:
+        """Stage cache parameters of fourier_transform, shared with the fused passes of Plan."""
+        return 'fourier_transform', bool(real_input)
+
+    @staticmethod
+    def _full_spectrum_from_rfft(half_spectrum: np.ndarray, n: int) -> np.ndarray:
+        """Rebuilds the two-sided spectrum of a real signal of length n from its rfft."""
+        full_spectrum = np.empty(half_spectrum.shape[:-1] + (n,), dtype=half_spectrum.dtype)
+        num_positive = half_spectrum.shape[-1]
+        full_spectrum[..., :num_positive] = half_spectrum
+        # X[n - k] = conj(X[k]) for real input
+        full_spectrum[..., num_positive:] = np.conj(half_spectrum[..., 1:n - num_positive + 1][..., ::-1])
+        return full_spectrum
     
-    def weight(self, fpath):
-        weights_df = pd.read_csv(fpath)
-        all_weights = weights_df['weights'].values
+    def _read_weights(self, fpath: str) -> np.ndarray:
+        all_weights = load_weights(fpath)
         if len(all_weights) != self._y.shape[1]:
-            raise DataError(f'Number of weights {len(weights_df)} does not match length of y-samples along time axis {self._y.shape[1]}')
-        for w_id, w in enumerate(all_weights):
-            self._y[:, w_id] *=  w
+            raise DataError(f'Number of weights {len(all_weights)} does not match length of y-samples along time axis {self._y.shape[1]}')
+        return all_weights
+
+    def weight(self, fpath):
+        all_weights = self._read_weights(fpath)
+        self._stage_key = None
+        with self._instrumentation.stage('weight'):
+            for rows in self._row_chunks():
+                self._y[rows] *= all_weights
         return self
 
-    def inverse_fourier_transform(self):
-        for row in range(self._y.shape[0]):
-            self._y[row] = ifft(self._y[row])
+    def inverse_fourier_transform(self, workers: int=None):
+        from scipy.fft import ifft
+        self._stage_key = None
+        # Only the real part is kept, as when assigning the complex result row by row
+        with self._instrumentation.stage('inverse_fourier_transform'):
+            for rows in self._row_chunks():
+                self._y[rows] = np.real(ifft(self._y[rows], axis=-1, workers=workers))
+                self._instrumentation.progress(rows.stop, self._y.shape[0])
         return self
-    
-    def save_to(self, fpath):
-        df = pd.DataFrame(np.concatenate((self._x, self._y), axis=-1))
+
+    def filter_bank(self, fpaths: Sequence[str], workers: int=None, real_input: bool=False) -> List[np.ndarray]:
+        """Applies several weightings to one Fourier transform of y.
+
+        Output i equals running fourier_transform -> weight(fpaths[i]) ->
+        inverse_fourier_transform on the current y, but every row chunk is transformed
+        once, weighted by all the weight vectors in one broadcast product and transformed
+        back in one batched inverse transform. y is left unchanged and the phase of the
+        transform is filled, the imaginary component is not stored.
+
+        Args:
+            fpaths: weight CSV files, see weight.
+            workers: number of threads used by scipy.fft, see fourier_transform.
+            real_input: see fourier_transform.
+
+        Returns:
+            one array of the shape of y per weight file, memory mapped to
+            filter_bank_<i>.npy when there is a backing_dir.
+        """
+        from scipy.fft import ifft
+        # Checked before any work is done, shape (num_weights, num_time_points)
+        weights = np.stack([self._read_weights(fpath) for fpath in fpaths])
+        outputs = [self._allocate(f'filter_bank_{i}', self._y.shape) for i in range(len(fpaths))]
+        num_rows = self._y.shape[0]
+        with self._instrumentation.stage('filter_bank'):
+            # The forward transform is shared with fourier_transform in the stage cache
+            forward = self._forward_stage(workers, real_input)
+            for rows in self._row_chunks():
+                self._check_cancelled()
+                real, imag = forward(rows)
+                self.phase[rows] = self._phase(real, imag)
+                # (num_weights, chunk rows, num_time_points), one inverse transform for all
+                # Cast to the storage type as weight does when it multiplies y in place
+                weighted = (real[None, :, :] * weights[:, None, :]).astype(self.dtype, copy=False)
+                filtered = np.real(ifft(weighted, axis=-1, workers=workers))
+                for output, values in zip(outputs, filtered):
+                    output[rows] = values
+                self._instrumentation.progress(rows.stop, num_rows)
+            forward.store()
+        return outputs
+
+    def demodulate(self, harmonics: Sequence[int]=(1,), phase_angles: Sequence[float]=None,
+                   weights: Sequence[float]=None, degrees: bool=True, in_phase_only: bool=False) -> np.ndarray:
+        """Phase sensitive detection of selected harmonics at a grid of phase angles.
+
+        For harmonic k and phase angle phi the demodulated spectrum is
+
+            A_k(phi) = c_k / N * w_k * sum_n y_n cos(phi - 2 pi k n / N)
+
+        with N = num_time_points, c_k = 2 (1 for k = 0 and k = N / 2) and w_k the weight of
+        the harmonic. All harmonics and angles are computed as a single matrix product of y
+        with a (N, num_harmonics * num_angles) kernel, without a full forward and inverse
+        transform. A_k at phi = 2 pi k n / N equals time sample n of
+        ifft(fft(y) * weights) when weights only keeps bins k and N - k.
+
+        With in_phase_only the kernel only keeps the real part of the spectrum,
+        cos(2 pi k n / N) * cos(phi), which reproduces fourier_transform -> weight ->
+        inverse_fourier_transform, since fourier_transform keeps the imaginary component
+        apart from y.
+
+        Args:
+            harmonics: harmonics k, between 0 and num_time_points // 2.
+            phase_angles: phase angles, defaults to 0 to 350 degrees in steps of 10.
+            weights: weight of each harmonic, defaults to 1.
+            degrees: phase_angles are in degrees, otherwise in radians.
+            in_phase_only: drop the quadrature (imaginary) part, see above.
+
+        Returns:
+            array of shape (num_sampling_points, num_harmonics, num_angles).
+        """
+        num_time_points = self._y.shape[-1]
+        harmonics = np.atleast_1d(np.asarray(harmonics, dtype=int))
+        if np.any(harmonics < 0) or np.any(harmonics > num_time_points // 2):
+            raise ValueError(f'harmonics must be between 0 and {num_time_points // 2}')
+        if phase_angles is None:
+            phase_angles = np.arange(0, 360, 10)
+            degrees = True
+        phase_angles = np.atleast_1d(np.asarray(phase_angles, dtype=np.float64))
+        if degrees:
+            phase_angles = np.deg2rad(phase_angles)
+        weights = np.ones(len(harmonics)) if weights is None else np.asarray(weights, dtype=np.float64)
+        if weights.shape != harmonics.shape:
+            raise DataError(f'Number of weights {len(weights)} does not match number of harmonics {len(harmonics)}')
+
+        one_sided = (harmonics == 0) | (2 * harmonics == num_time_points)
+        scale = np.where(one_sided, 1.0, 2.0) / num_time_points * weights
+        theta = 2 * np.pi * np.outer(np.arange(num_time_points), harmonics) / num_time_points
+        if in_phase_only:
+            kernel = np.cos(theta)[:, :, None] * np.cos(phase_angles)[None, None, :]
+        else:
+            kernel = np.cos(phase_angles[None, None, :] - theta[:, :, None])
+        kernel *= scale[None, :, None]
+        kernel = kernel.reshape((num_time_points, -1))
+
+        demodulated = np.empty((self._y.shape[0], len(harmonics), len(phase_angles)))
+        for rows in self._row_chunks():
+            demodulated[rows] = (self._y[rows] @ kernel).reshape((-1, len(harmonics), len(phase_angles)))
+        return demodulated
+
+    def _write_csv(self, fpath: str, values: np.ndarray) -> None:
+        """Writes x next to values chunk by chunk, in the layout of DataFrame.to_csv."""
+        import pandas as pd
+        num_rows = values.shape[0]
+        step = self.CSV_CHUNK_ROWS if self.chunk_rows is None else self.chunk_rows
+        with open(fpath, 'w', newline='') as fp:
+            for start in range(0, num_rows, step):
+                rows = slice(start, min(start + step, num_rows))
+                df = pd.DataFrame(np.concatenate((self._x[rows], values[rows]), axis=-1),
+                                  index=pd.RangeIndex(rows.start, rows.stop))
+                df.to_csv(fp, header=rows.start == 0)
+
+    def _write_npy(self, fpath: str, values: np.ndarray) -> None:
+        """Writes [x, values] as one (num_sampling_points, 1 + num_time_points) array."""
+        out = np.lib.format.open_memmap(fpath, mode='w+', dtype=np.float64,
+                                        shape=(values.shape[0], values.shape[1] + 1))
+        out[:, :1] = self._x
+        for rows in self._row_chunks():
+            out[rows, 1:] = values[rows]
+        out.flush()
+        del out
+
+    def _write_npz(self, fpath: str, values: np.ndarray) -> None:
+        """Writes x and values as separate arrays named 'x' and 'y'."""
+        np.savez(fpath, x=self._x, y=values)
+
+    def _write_parquet(self, fpath: str, values: np.ndarray) -> None:
+        """Writes the CSV columns to Parquet, needs pyarrow or fastparquet."""
+        import pandas as pd
+        df = pd.DataFrame(np.concatenate((self._x, values), axis=-1))
+        df.columns = df.columns.astype(str)
+        df.to_parquet(fpath)
+
+    @classmethod
+    def check_output_format(cls, fmt: str) -> None:
+        """Raises a ValueError unless fmt is one of OUTPUT_FORMATS."""
+        if fmt.lower() == cls.PARQUET and cls.PARQUET not in cls.OUTPUT_FORMATS:
+            raise ValueError(f'output format {fmt} needs one of {cls.PARQUET_ENGINES} installed')
+        if fmt.lower() not in cls.OUTPUT_FORMATS:
+            raise ValueError(f'output format {fmt} not recognized, use one of {cls.OUTPUT_FORMATS}')
+
+    def _write(self, fpath: str, values: np.ndarray, fmt: str=None) -> None:
+        writers = {
+            self.CSV: self._write_csv,
+            self.NPY: self._write_npy,
+            self.NPZ: self._write_npz,
+            self.PARQUET: self._write_parquet,
+        }
+        if fmt is None:
+            fmt = splitext(fpath)[1].lstrip('.').lower() or self.CSV
+            # Known formats that cannot be written, e.g. parquet without an engine, raise below
+            if fmt not in writers:
+                fmt = self.CSV
+        self.check_output_format(fmt)
         print('Writing to ', fpath)
-        df.to_csv(fpath)
+        with self._instrumentation.stage('save'):
+            writers[fmt.lower()](fpath, values)
     
-    def save_phase_to(self, fpath):
-        df = pd.DataFrame(np.concatenate((self._x, self._phase), axis=-1))
-        print('Writing to ', fpath)
-        df.to_csv(fpath)
+    def save_to(self, fpath, fmt: str=None):
+        """Saves x and y. fmt is one of OUTPUT_FORMATS and defaults to the file extension,
+        files with other extensions are written as CSV."""
+        self._write(fpath, self._y, fmt=fmt)
     
-    def baseline_correct(self, method: str, configs: dict) -> None:
-        if method.lower() == 'arpls':
+    def save_phase_to(self, fpath, fmt: str=None):
+        """Saves x and the phase, see save_to."""
+        self._write(fpath, self.phase, fmt=fmt)
+
+    def save_array_to(self, fpath, values: np.ndarray, fmt: str=None):
+        """Saves x and values, an array of the shape of y such as an output of filter_bank,
+        see save_to."""
+        self._write(fpath, values, fmt=fmt)
+    
+    def _check_baseline_configs(self, method: str, configs: dict) -> None:
+        """Raises a ValueError for an unknown method or configs it does not take."""
+        expected = self.BASELINE_CONFIG_KEYS.get(method.lower())
+        if expected is None:
+            raise ValueError(f'method {method} not recognized')
+        unknown = sorted(set(configs) - set(expected))
+        if unknown:
+            raise ValueError(f'baseline_correction_configs {unknown} not recognized for {method}, '
+                             f'use {expected}')
+
+    def baseline_correct(self, method: str, configs: dict, workers: int=1,
+                         warm_start: bool=False) -> List[dict]:
+        """Subtracts a baseline from every time sample (column) of y.
+
+        Args:
+            method: baseline correction method, one of BASELINE_METHODS.
+            configs: method parameters, e.g. {'lambda': 1e5, 'stop_ratio': 1e-6, 'max_iters': 100}
+                for 'arpls', {'max_half_window': 40, 'smooth_half_window': 5} for 'snip' and
+                {'half_window': 40, 'smooth_half_window': 5} for 'rolling_ball'.
+            workers: number of processes. With more than one worker the columns are
+                distributed over a process pool sharing y and the baseline through shared
+                memory; without warm_start the baselines are identical to the serial path.
+            warm_start: start the weights of every column from the converged weights of
+                the previous one, which has a very similar baseline, instead of uniform
+                weights. Columns that do not converge that way are solved again from a
+                cold start. With workers > 1 the first column of every task starts cold.
+
+        Returns:
+            per column info of the ARPLS solver: num_iters, final_ratio, converged and
+            restarted (a warm start fell back to a cold start). Empty for the other methods.
+        """
+        self._check_baseline_configs(method, configs)
+        configs = dict(configs)
+        # Only warm started tasks depend on the number of workers, see parallel_baselines
+        key = self._stage_key_of('baseline_correct', method.lower(), configs, warm_start,
+                                 workers if warm_start else 1)
+        if method.lower() == self.BASELINE_ARPLS:
             lambda_ = configs.pop('lambda')
             baseline_corrector = ARPLS(lambda_=lambda_)
+        elif method.lower() == self.BASELINE_SNIP:
+            baseline_corrector = SNIP(**configs)
+        elif method.lower() == self.BASELINE_ROLLING_BALL:
+            baseline_corrector = RollingBall(**configs)
         else:
             raise ValueError(f'method {method} not recognized')
 
-        for time_sample in range(self.y.shape[-1]):
-            self._baseline[:, time_sample] = baseline_corrector.get_baseline(
-                y=self._y[:, time_sample], 
-                **configs)
-        self._y -= self._baseline
+        instrumentation = self._instrumentation
+        num_columns = self._y.shape[-1]
+        with instrumentation.stage('baseline_correct'):
+            cached = self._get_stage(key)
+            if cached is not None:
+                self.baseline[:] = cached['baseline']
+                infos = [{name: cached[name][column].item() for name in self.BASELINE_INFO_KEYS}
+                         for column in range(len(cached['num_iters']))]
+            elif not isinstance(baseline_corrector, ARPLS):
+                infos = []
+                for columns in self._column_chunks():
+                    self._check_cancelled()
+                    self.baseline[:, columns] = baseline_corrector.get_baselines(self._y[:, columns])
+                    instrumentation.progress(columns.stop, num_columns)
+            elif workers > 1:
+                infos = parallel_baselines(
+                    self._y, baseline_corrector, configs, workers=workers, out=self.baseline,
+                    warm_start=warm_start, cancel_event=self._cancel_event,
+                    on_progress=instrumentation.progress if instrumentation.enabled else None)
+            else:
+                infos = []
+                weights = None
+                for columns in self._column_chunks():
+                    y_block = np.ascontiguousarray(self._y[:, columns])
+                    baseline_block = np.empty_like(y_block)
+                    for time_sample in range(y_block.shape[-1]):
+                        self._check_cancelled()
+                        baseline_block[:, time_sample], _, info = baseline_corrector.get_baseline(
+                            y=y_block[:, time_sample], full_output=True,
+                            w0=weights if warm_start else None, **configs)
+                        weights = info.pop('weights')
+                        infos.append(info)
+                        instrumentation.progress(columns.start + time_sample + 1, num_columns)
+                    self.baseline[:, columns] = baseline_block
+            if cached is None:
+                self._put_stage(key, baseline=self.baseline, **{
+                    name: np.array([info[name] for info in infos]) for name in self.BASELINE_INFO_KEYS})
+            for info in infos:
+                instrumentation.record('arpls_iterations', info['num_iters'])
+                instrumentation.record('arpls_final_ratio', float(info['final_ratio']))
+            instrumentation.count('arpls_restarts', sum(info['restarted'] for info in infos))
+            for rows in self._row_chunks():
+                self._y[rows] -= self.baseline[rows]
+        self._stage_key = key
+        return infos
+
+
+class _ForwardStage:
+    """The forward transform of the y of data, row chunk by row chunk, through the stage
+    cache. A hit reads the chunks from the cache. A miss transforms them and, when y is
+    tracked by the stage cache, collects them for store: into out, a (real, imag) pair of
+    arrays of the shape of y, or into arrays allocated by Data._allocate.
+    """
+
+    def __init__(self, data: Data, workers: int=None, real_input: bool=False,
+                 out: Tuple[np.ndarray, np.ndarray]=None) -> None:
+        self.data = data
+        self.workers = workers
+        self.real_input = real_input
+        self.key = data._stage_key_of(*data._fourier_transform_parameters(real_input))
+        self.cached = data._get_stage(self.key)
+        self.forward = None
+        if out is not None:
+            self.forward = dict(zip(('real', 'imag'), out))
+        elif self.key is not None and self.cached is None:
+            self.forward = {part: data._allocate(f'forward_{part}', data._y.shape) for part in ('real', 'imag')}
+
+    def __call__(self, rows: slice) -> Tuple[np.ndarray, np.ndarray]:
+        """Real and imaginary parts of the transform of the rows of y."""
+        if self.cached is not None:
+            # Copies of the chunk, the cached arrays are read only memory maps
+            return np.array(self.cached['real'][rows]), np.array(self.cached['imag'][rows])
+        real, imag = self.data._forward_transform(self.data._y[rows], self.workers, self.real_input)
+        if self.forward is not None:
+            self.forward['real'][rows] = real
+            self.forward['imag'][rows] = imag
+        return real, imag
 
+    def store(self) -> None:
+        """Stores the collected transform after a miss."""
+        if self.cached is None and self.forward is not None:
+            self.data._put_stage(self.key, **self.forward)
@@ -7,3 +7,7 @@ class DataError(RuntimeError):
 class NotConvergedError(RuntimeError):
     """ Raise error related to convergence. """
     pass
+
+class CancelledError(RuntimeError):
+    """ Raise when processing is cancelled through its cancel event. """
+    pass
@@ -0,0 +1,160 @@
+"""Per stage timing, memory and progress reporting for the processing pipeline."""
+from __future__ import annotations
+from contextlib import contextmanager
+from datetime import datetime
+import json
+import threading
+import time
+import tracemalloc
+from typing import Callable, Dict, Iterator, List, Optional
+
+
+class StageRecord:
+    """Measurements of one stage, filled while the stage runs."""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.wall_seconds = None
+        self.cpu_seconds = None
+        self.peak_bytes = None
+        self.counters: Dict[str, float] = {}
+        self.values: Dict[str, list] = {}
+
+    def to_dict(self) -> dict:
+        return {
+            'stage': self.name,
+            'wall_seconds': self.wall_seconds,
+            'cpu_seconds': self.cpu_seconds,
+            'peak_bytes': self.peak_bytes,
+            'counters': dict(self.counters),
+            'values': {key: list(values) for key, values in self.values.items()},
+        }
+
+
+class JsonLogSink:
+    """Appends every event as one JSON line to a file."""
+
+    def __init__(self, fpath: str) -> None:
+        self.fpath = fpath
+        self._lock = threading.Lock()
+
+    def __call__(self, event: dict) -> None:
+        line = json.dumps(event, default=float)
+        with self._lock, open(self.fpath, 'a') as fp:
+            fp.write(line + '\n')
+
+
+class CallbackSink:
+    """Hands every event to a callable, e.g. to drive a progress bar."""
+
+    def __init__(self, callback: Callable[[dict], None]) -> None:
+        self.callback = callback
+
+    def __call__(self, event: dict) -> None:
+        self.callback(event)
+
+
+class Instrumentation:
+    """Records wall time, CPU time, peak allocation and counters per stage and emits
+    them as events to the sinks.
+
+    Events are dicts with an 'event' key:
+        'stage_start': {'stage'}
+        'progress': {'stage', 'done', 'total'}
+        'stage_end': StageRecord.to_dict()
+
+    Args:
+        sinks: callables receiving each event, see JsonLogSink and CallbackSink.
+        trace_memory: measure the peak allocation of every stage with tracemalloc, which
+            slows Python heavy stages down noticeably.
+    """
+    enabled = True
+
+    def __init__(self, sinks: List[Callable[[dict], None]]=(), trace_memory: bool=False) -> None:
+        self.sinks = list(sinks)
+        self.trace_memory = trace_memory
+        self.records: List[StageRecord] = []
+        self._current: Optional[StageRecord] = None
+
+    def emit(self, event: dict) -> None:
+        event.setdefault('time', datetime.now().isoformat())
+        for sink in self.sinks:
+            sink(event)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[StageRecord]:
+        record = StageRecord(name)
+        parent, self._current = self._current, record
+        started_tracing = False
+        if self.trace_memory:
+            if tracemalloc.is_tracing():
+                tracemalloc.reset_peak()
+            else:
+                tracemalloc.start()
+                started_tracing = True
+        self.emit({'event': 'stage_start', 'stage': name})
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            record.wall_seconds = time.perf_counter() - wall_start
+            record.cpu_seconds = time.process_time() - cpu_start
+            if self.trace_memory:
+                record.peak_bytes = tracemalloc.get_traced_memory()[1]
+                if started_tracing:
+                    tracemalloc.stop()
+            self._current = parent
+            self.records.append(record)
+            self.emit(dict(record.to_dict(), event='stage_end'))
+
+    def count(self, key: str, value: float=1) -> None:
+        """Adds value to a counter of the current stage."""
+        if self._current is not None:
+            self._current.counters[key] = self._current.counters.get(key, 0) + value
+
+    def record(self, key: str, value) -> None:
+        """Appends value to a per item series of the current stage, e.g. one per column."""
+        if self._current is not None:
+            self._current.values.setdefault(key, []).append(value)
+
+    def progress(self, done: int, total: int) -> None:
+        if self._current is not None:
+            self.emit({'event': 'progress', 'stage': self._current.name, 'done': done, 'total': total})
+
+    def summary(self) -> List[dict]:
+        return [record.to_dict() for record in self.records]
+
+
+class _NullStage:
+    def __enter__(self) -> None:
+        return None
+
+    def __exit__(self, *exc_info) -> bool:
+        return False
+
+
+class NullInstrumentation:
+    """Disabled instrumentation, every call is a no-op."""
+    enabled = False
+    _stage = _NullStage()
+
+    def stage(self, name: str) -> _NullStage:
+        return self._stage
+
+    def emit(self, event: dict) -> None:
+        pass
+
+    def count(self, key: str, value: float=1) -> None:
+        pass
+
+    def record(self, key: str, value) -> None:
+        pass
+
+    def progress(self, done: int, total: int) -> None:
+        pass
+
+    def summary(self) -> List[dict]:
+        return []
+
+
+NULL_INSTRUMENTATION = NullInstrumentation()
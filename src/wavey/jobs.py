@@ -0,0 +1,119 @@
+"""Runs pipeline jobs on worker threads for interactive front ends such as ui.py."""
+from __future__ import annotations
+from concurrent.futures import Future, ThreadPoolExecutor
+import itertools
+from os.path import abspath
+import queue
+import threading
+from typing import Dict, List, Optional
+
+from wavey.exceptions import CancelledError
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class Job:
+    """One pipeline run and its state, only changed by the JobEngine."""
+
+    def __init__(self, job_id: int, configs: dict) -> None:
+        self.job_id = job_id
+        self.configs = configs
+        self.status = QUEUED
+        self.outputs: Optional[Dict[str, str]] = None
+        self.error: Optional[str] = None
+        self.cancel_event = threading.Event()
+        self.future: Optional[Future] = None
+
+
+class JobEngine:
+    """Runs pipeline.load and pipeline.process for every submitted configuration on a pool
+    of worker threads, at most max_concurrent at the same time.
+
+    The workers never call back into the front end. Everything they report is put on the
+    events queue, which the front end drains from its own thread, e.g. from a Tk after()
+    callback. Events are dicts with the job_id and an 'event' key:
+        'status': {'status', 'outputs' when done, 'error' when failed}
+        'stage_start', 'progress', 'stage_end': the instrumentation events of the job,
+            see wavey.instrumentation.Instrumentation.
+
+    Cancelling a running job sets its cancel event, which Data checks between files,
+    baseline columns and row chunks.
+    """
+
+    def __init__(self, max_concurrent: int=2) -> None:
+        self.events: queue.Queue = queue.Queue()
+        self.jobs: Dict[int, Job] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix='wavey-job')
+
+    def submit(self, configs: dict) -> int:
+        """Queues a run of configs and returns its job id.
+
+        Raises:
+            ValueError: when an unfinished job already writes to the same out_dir, or
+                configs fail pipeline.check_configs.
+        """
+        from wavey import pipeline
+        pipeline.check_configs(configs)
+        with self._lock:
+            for job in self.jobs.values():
+                if job.status not in FINISHED and abspath(job.configs['out_dir']) == abspath(configs['out_dir']):
+                    raise ValueError(f"Job {job.job_id} already writes to {configs['out_dir']}")
+            job = Job(next(self._ids), configs)
+            self.jobs[job.job_id] = job
+        self._set_status(job, QUEUED)
+        job.future = self._executor.submit(self._run, job)
+        return job.job_id
+
+    def cancel(self, job_id: int) -> None:
+        """Cancels a queued job right away and a running one at its next cancellation point."""
+        job = self.jobs[job_id]
+        job.cancel_event.set()
+        if job.future is not None and job.future.cancel():
+            self._set_status(job, CANCELLED)
+
+    def drain(self) -> List[dict]:
+        """Returns the events put on the queue since the last call, without blocking."""
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                return events
+
+    def shutdown(self, cancel: bool=True) -> None:
+        """Stops accepting jobs, cancelling the unfinished ones with cancel, and waits for
+        the running ones to return."""
+        if cancel:
+            for job_id in list(self.jobs):
+                self.cancel(job_id)
+        self._executor.shutdown(wait=True)
+
+    def _set_status(self, job: Job, status: str, **details) -> None:
+        job.status = status
+        self.events.put(dict(details, job_id=job.job_id, event='status', status=status))
+
+    def _run(self, job: Job) -> None:
+        # Imported by the first job, on its worker thread, so front ends start without
+        # waiting for numpy and scipy
+        from wavey import pipeline
+        self._set_status(job, RUNNING)
+        sink = lambda event: self.events.put(dict(event, job_id=job.job_id))
+        try:
+            instrumentation = pipeline.instrumentation_from(job.configs, sinks=[sink])
+            spectral_data = pipeline.load(job.configs, instrumentation=instrumentation,
+                                          cancel_event=job.cancel_event)
+            job.outputs = pipeline.process(spectral_data, job.configs)
+        except CancelledError:
+            self._set_status(job, CANCELLED)
+        except Exception as e:
+            job.error = str(e)
+            self._set_status(job, FAILED, error=job.error)
+        else:
+            self._set_status(job, DONE, outputs=job.outputs)
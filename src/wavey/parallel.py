@@ -0,0 +1,141 @@
+"""Process pool helpers that share the data matrices instead of pickling them."""
+from __future__ import annotations
+from concurrent.futures import ProcessPoolExecutor, wait
+import multiprocessing
+from multiprocessing import shared_memory
+import threading
+from typing import Callable, List, Tuple
+
+import numpy as np
+
+from wavey.exceptions import CancelledError
+
+# Per worker process state, set once by _init_baseline_worker
+_worker_state = {}
+
+# Seconds between two checks of the cancel event while waiting for a task
+CANCEL_POLL_SECONDS = 0.1
+
+SHARED_MEMORY = 'shm'
+MEMORY_MAP = 'memmap'
+
+
+def _attach(spec: Tuple) -> Tuple[object, np.ndarray]:
+    """Opens the array described by spec, see _share."""
+    kind, name, shape, dtype, offset = spec
+    if kind == MEMORY_MAP:
+        return None, np.memmap(name, dtype=dtype, mode='r+', offset=offset, shape=shape)
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _share(array: np.ndarray, to_release: List[shared_memory.SharedMemory], copy: bool=True) -> Tuple:
+    """Returns a spec other processes can attach to, without pickling the data.
+
+    Memory mapped arrays are shared through their file, anything else is copied to a new
+    shared memory block, which is appended to to_release.
+    """
+    if isinstance(array, np.memmap) and array.filename is not None:
+        array.flush()
+        return MEMORY_MAP, array.filename, array.shape, array.dtype.str, array.offset
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    to_release.append(shm)
+    if copy:
+        np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[:] = array
+    return SHARED_MEMORY, shm.name, array.shape, array.dtype.str, 0
+
+
+def _init_baseline_worker(y_spec, baseline_spec, baseline_corrector, configs, warm_start, stop_event) -> None:
+    y_shm, y = _attach(y_spec)
+    baseline_shm, baseline = _attach(baseline_spec)
+    _worker_state.update(
+        shms=(y_shm, baseline_shm), y=y, baseline=baseline,
+        baseline_corrector=baseline_corrector, configs=configs, warm_start=warm_start,
+        stop_event=stop_event)
+
+
+def _baseline_columns(start: int, stop: int) -> List[dict]:
+    y = _worker_state['y']
+    baseline = _worker_state['baseline']
+    baseline_corrector = _worker_state['baseline_corrector']
+    configs = _worker_state['configs']
+    infos = []
+    stop_event = _worker_state['stop_event']
+    weights = None
+    for time_sample in range(start, stop):
+        if stop_event is not None and stop_event.is_set():
+            break
+        baseline[:, time_sample], _, info = baseline_corrector.get_baseline(
+            y=y[:, time_sample], full_output=True,
+            w0=weights if _worker_state['warm_start'] else None, **configs)
+        # The weights stay in the worker, only the scalars are sent back
+        weights = info.pop('weights')
+        infos.append(info)
+    if isinstance(baseline, np.memmap):
+        baseline.flush()
+    return infos
+
+
+def parallel_baselines(y: np.ndarray, baseline_corrector, configs: dict, workers: int,
+                       out: np.ndarray, chunk_size: int=None, warm_start: bool=False,
+                       cancel_event: threading.Event=None, on_progress: Callable[[int, int], None]=None) -> List[dict]:
+    """Computes the baseline of every column of y in a pool of worker processes.
+
+    y and the output are placed in shared memory, or opened from their files when they
+    are memory mapped, so the workers only receive column ranges. Every column goes
+    through the same code as the serial loop in Data.baseline_correct and lands in its
+    own slot, which keeps the result identical to the serial path regardless of
+    scheduling. With warm_start the first column of every task starts cold, so the
+    baselines can differ from the serial ones within the stop_ratio.
+
+    Args:
+        y: matrix of shape (num_sampling_points, num_time_points).
+        baseline_corrector: picklable object with a get_baseline(y, **configs) method.
+        configs: keyword arguments for get_baseline.
+        workers: number of worker processes.
+        out: array of the same shape as y the baselines are written to.
+        chunk_size: number of consecutive columns per task. Defaults to an even split
+            into 4 tasks per worker.
+        warm_start: seed every column with the weights of the previous column of its
+            task, see ARPLS.get_baseline(w0=...).
+        cancel_event: when it is set, the tasks that have not started are cancelled, the
+            running ones stop after their current column and CancelledError is raised.
+        on_progress: called as on_progress(num_columns_done, num_columns) in the calling
+            process after each task.
+
+    Returns:
+        the info dict of get_baseline for every column, in column order.
+    """
+    num_columns = y.shape[-1]
+    if chunk_size is None:
+        chunk_size = max(1, -(-num_columns // (4 * workers)))
+    to_release = []
+    try:
+        y_spec = _share(y, to_release)
+        baseline_spec = _share(out, to_release, copy=False)
+        # Handed to the workers when they start, they cannot receive it with a task
+        stop_event = None if cancel_event is None else multiprocessing.Event()
+        initargs = (y_spec, baseline_spec, baseline_corrector, configs, warm_start, stop_event)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_baseline_worker,
+                                 initargs=initargs) as executor:
+            futures = [executor.submit(_baseline_columns, start, min(start + chunk_size, num_columns))
+                       for start in range(0, num_columns, chunk_size)]
+            infos = []
+            for future in futures:
+                while cancel_event is not None and not wait([future], timeout=CANCEL_POLL_SECONDS).done:
+                    if cancel_event.is_set():
+                        stop_event.set()
+                        for pending in futures:
+                            pending.cancel()
+                        raise CancelledError('Processing was cancelled')
+                infos.extend(future.result())
+                if on_progress is not None:
+                    on_progress(len(infos), num_columns)
+        if baseline_spec[0] == SHARED_MEMORY:
+            shm = to_release[-1]
+            out[:] = np.ndarray(out.shape, dtype=out.dtype, buffer=shm.buf)
+    finally:
+        for shm in to_release:
+            shm.close()
+            shm.unlink()
+    return infos
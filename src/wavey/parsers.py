@@ -0,0 +1,202 @@
+"""Bulk parsers for the supported spectrum file formats.
+
+Each parser locates the data block once and decodes the numeric columns with a single
+call to the numpy C reader. Blocks the C reader rejects (cells that are not numbers,
+missing fields) are decoded row by row with float() instead. In both cases rows where
+x or y is not a number are dropped, as in the original row by row loader.
+"""
+from __future__ import annotations
+import csv
+from functools import lru_cache
+import io
+import os
+from os.path import abspath
+from typing import Iterable, List, Optional, Tuple
+import warnings
+
+import numpy as np
+
+from wavey.constants import IR, RAMAN, UV_VIS
+from wavey.exceptions import DataError
+
+RAMAN_X_NAME = 'Raman Shift'
+RAMAN_Y_NAME = 'Dark Subtracted #1'
+UV_VIS_NUM_COLUMNS = 5
+# Number of parsed weight files kept in memory by load_weights
+WEIGHTS_CACHE_SIZE = 32
+
+
+def _to_float(value: str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        return np.nan
+
+
+def _drop_nan(x: np.ndarray, y: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    keep = ~(np.isnan(x) | np.isnan(y))
+    return x[keep].reshape((-1, 1)), y[keep].reshape((-1, 1))
+
+
+def _read_columns(lines: Iterable[str], x_col: int, y_col: int, delimiter: str) -> np.ndarray:
+    """Decodes two columns of a delimited block in one call. Raises ValueError on bad cells."""
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', UserWarning)  # empty block
+        return np.loadtxt(lines, delimiter=delimiter, usecols=(x_col, y_col), comments=None,
+                          ndmin=2, dtype=np.float64)
+
+
+def _read_rows(rows: List[List[str]], x_col: int, y_col: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Row by row fallback, cells float() rejects or rows too short to hold become NaN."""
+    x = np.array([_to_float(row[x_col]) if len(row) > x_col else np.nan for row in rows], dtype=np.float64)
+    y = np.array([_to_float(row[y_col]) if len(row) > y_col else np.nan for row in rows], dtype=np.float64)
+    return _drop_nan(x, y)
+
+
+def _read_csv_block(text: str, x_col: int, y_col: int) -> Tuple[np.ndarray, np.ndarray]:
+    try:
+        data = _read_columns(io.StringIO(text), x_col, y_col, delimiter=',')
+    except ValueError:
+        rows = [row for row in csv.reader(io.StringIO(text, newline=''), delimiter=',') if row]
+        return _read_rows(rows, x_col, y_col)
+    return _drop_nan(data[:, 0], data[:, 1])
+
+
+def load_raman(fpath: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Loads the 'Raman Shift' and 'Dark Subtracted #1' columns below the header row."""
+    with open(fpath, newline='') as csvfile:
+        text = csvfile.read()
+    buf = io.StringIO(text, newline='')
+    while True:
+        line = buf.readline()
+        if not line:
+            raise DataError(f'Could not find the {RAMAN_X_NAME} column in {fpath}')
+        header = next(csv.reader([line], delimiter=','), [])
+        if RAMAN_X_NAME in header:
+            break
+    if RAMAN_Y_NAME not in header:
+        raise DataError(f'Could not find the {RAMAN_Y_NAME} column in {fpath}')
+    return _read_csv_block(text[buf.tell():], header.index(RAMAN_X_NAME), header.index(RAMAN_Y_NAME))
+
+
+def load_ir(fpath: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Loads a plain two column CSV file of wavenumbers and responses."""
+    with open(fpath, newline='') as csvfile:
+        text = csvfile.read()
+    return _read_csv_block(text, 0, 1)
+
+
+def load_uv_vis(fpath: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Loads the first and last column of the semicolon separated rows of a UV-Vis TXT file.
+
+    Only rows with exactly five fields belong to the data table, the first of them holds
+    the column labels.
+    """
+    with open(fpath, 'r') as f:
+        lines = f.read().split('\n')
+    table = [line for line in lines if line.count(';') == UV_VIS_NUM_COLUMNS - 1][1:]
+    x_col, y_col = 0, UV_VIS_NUM_COLUMNS - 1
+    try:
+        data = _read_columns(table, x_col, y_col, delimiter=';')
+    except ValueError:
+        return _read_rows([line.split(';') for line in table], x_col, y_col)
+    return _drop_nan(data[:, 0], data[:, 1])
+
+
+class Region:
+    """Region of interest applied to every spectrum right after parsing.
+
+    Only points with x_min <= x <= x_max are kept. They can then be averaged into bins of
+    bin_width in x units, anchored at multiples of bin_width, or into groups of decimation
+    consecutive points, of which an incomplete last group is dropped. x is assumed to be
+    monotonic, as in every supported file format.
+    """
+
+    def __init__(self, x_min: float=None, x_max: float=None, bin_width: float=None,
+                 decimation: int=None) -> None:
+        if x_min is not None and x_max is not None and x_min > x_max:
+            raise ValueError(f'x_min {x_min} is larger than x_max {x_max}')
+        if bin_width is not None and bin_width <= 0:
+            raise ValueError(f'bin_width must be positive, got {bin_width}')
+        if decimation is not None and decimation < 1:
+            raise ValueError(f'decimation must be at least 1, got {decimation}')
+        if bin_width is not None and decimation not in (None, 1):
+            raise ValueError('Use either bin_width or decimation, not both')
+        self.x_min = None if x_min is None else float(x_min)
+        self.x_max = None if x_max is None else float(x_max)
+        self.bin_width = None if bin_width is None else float(bin_width)
+        self.decimation = None if decimation in (None, 1) else int(decimation)
+
+    def is_full(self) -> bool:
+        """True when the region keeps every point unchanged."""
+        return self.x_min is None and self.x_max is None and self.bin_width is None and self.decimation is None
+
+    def key(self) -> str:
+        return f'{self.x_min}|{self.x_max}|{self.bin_width}|{self.decimation}'
+
+    def apply(self, x: np.ndarray, y: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns x and y of shape (num_points, 1) restricted to the region."""
+        keep = np.ones(len(x), dtype=bool)
+        if self.x_min is not None:
+            keep &= x[:, 0] >= self.x_min
+        if self.x_max is not None:
+            keep &= x[:, 0] <= self.x_max
+        if not keep.all():
+            x, y = x[keep], y[keep]
+        if self.bin_width is not None and len(x):
+            bin_ids = np.floor(x[:, 0] / self.bin_width)
+            starts = np.flatnonzero(np.r_[True, np.diff(bin_ids) != 0])
+            counts = np.diff(np.r_[starts, len(x)]).reshape((-1, 1))
+            x = np.add.reduceat(x, starts, axis=0) / counts
+            y = np.add.reduceat(y, starts, axis=0) / counts
+        elif self.decimation is not None:
+            num_groups = len(x) // self.decimation
+            x = x[:num_groups * self.decimation].reshape((num_groups, self.decimation)).mean(axis=-1, keepdims=True)
+            y = y[:num_groups * self.decimation].reshape((num_groups, self.decimation)).mean(axis=-1, keepdims=True)
+        return x, y
+
+
+PARSERS = {
+    RAMAN: load_raman,
+    IR: load_ir,
+    UV_VIS: load_uv_vis,
+}
+
+FILE_PATTERNS = {
+    RAMAN: '*.csv',
+    IR: '*.csv',
+    UV_VIS: '*.TXT',
+}
+
+
+def load_spectrum(fpath: str, ftype: str, region: Optional[Region]=None) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns x and y of a spectrum file, each of shape (num_sampling_points, 1),
+    restricted to region when given."""
+    try:
+        parser = PARSERS[ftype.lower()]
+    except KeyError:
+        raise NotImplementedError(f'{ftype} ftype not supported')
+    x, y = parser(fpath)
+    if region is not None and not region.is_full():
+        x, y = region.apply(x, y)
+    return x, y
+
+
+@lru_cache(maxsize=WEIGHTS_CACHE_SIZE)
+def _load_weights(fpath: str, size: int, mtime_ns: int) -> np.ndarray:
+    import pandas as pd
+    weights = pd.read_csv(fpath)['weights'].values
+    # Shared by every caller of the cache
+    weights.setflags(write=False)
+    return weights
+
+
+def load_weights(fpath: str) -> np.ndarray:
+    """Returns the 'weights' column of a weight CSV file as a read-only array.
+
+    Parsed files are cached in memory by absolute path, size and modification time, so
+    applying the same weights to several experiments parses the file once and an edited
+    file is parsed again.
+    """
+    stat = os.stat(fpath)
+    return _load_weights(abspath(fpath), stat.st_size, stat.st_mtime_ns)
@@ -0,0 +1,129 @@
+"""Processing pipeline driven by the YAML configuration of wavey.py."""
+from __future__ import annotations
+from os import makedirs
+from os.path import basename, join, splitext
+from typing import Callable, Dict, List
+
+from wavey import constants
+from wavey.data import Data
+from wavey.instrumentation import Instrumentation, JsonLogSink
+
+DEFAULT_CACHE_MAX_MEGABYTES = 1024
+
+
+def instrumentation_from(configs: dict, sinks: List[Callable[[dict], None]]=()) -> Instrumentation:
+    """Instrumentation writing to the instrumentation_log of configs, if set, and sinks.
+
+    Returns None when there is nowhere to send the events, which disables it.
+    """
+    sinks = list(sinks)
+    if configs.get('instrumentation_log'):
+        sinks.append(JsonLogSink(configs['instrumentation_log']))
+    if not sinks:
+        return None
+    return Instrumentation(sinks=sinks, trace_memory=bool(configs.get('instrumentation_trace_memory')))
+
+
+def load(configs: dict, **kwargs) -> Data:
+    """Builds Data from the spectrum_dir of configs. kwargs are passed on to Data."""
+    kwargs.setdefault('instrumentation', instrumentation_from(configs))
+    cache_max_megabytes = configs.get('cache_max_megabytes') or DEFAULT_CACHE_MAX_MEGABYTES
+    return Data(
+        in_dir=configs['spectrum_dir'],
+        num_time_points=int(configs.get('number_of_time_points')),
+        start=configs.get('start_frame'),
+        end=configs.get('end_frame'),
+        ftype=configs.get('spectra_type'),
+        load_workers=int(configs.get('load_workers') or 1),
+        cache_dir=configs.get('cache_dir'),
+        cache_max_bytes=int(cache_max_megabytes * 1024 ** 2),
+        backing_dir=configs.get('backing_dir'),
+        dtype=configs.get('dtype') or 'float64',
+        x_range=(configs.get('x_min'), configs.get('x_max')),
+        bin_width=configs.get('bin_width'),
+        decimation=configs.get('decimation'),
+        repeat_statistics=bool(configs.get('save_repeat_statistics')),
+        stage_cache_dir=configs.get('stage_cache_dir'),
+        stage_cache_max_bytes=int((configs.get('stage_cache_max_megabytes') or DEFAULT_CACHE_MAX_MEGABYTES) * 1024 ** 2),
+        **kwargs)
+
+
+def check_configs(configs: dict) -> None:
+    """Raises a ValueError for settings that would only fail once the data is loaded
+    and processed, such as an output_format that cannot be written."""
+    Data.check_output_format(configs.get('output_format') or Data.CSV)
+
+
+def process(spectral_data: Data, configs: dict) -> Dict[str, str]:
+    """Runs the baseline correction, Fourier transform, weighting and inverse transform
+    on spectral_data and saves every stage to out_dir. With weight_files every weighting
+    is saved to transformed_data_<weight file name>, from a single forward transform.
+    With save_repeat_statistics the variance and standard error of the original data
+    across the repetitions are saved as well, spectral_data must hold them.
+
+    Returns:
+        paths of the written files by output name.
+    """
+    weight_file = configs.get('weight_file')
+    weight_files = configs.get('weight_files') or []
+    baseline_correction_method = configs.get('baseline_correction_method', None)
+    output_format = configs.get('output_format') or Data.CSV
+    check_configs(configs)
+    baseline_workers = int(configs.get('baseline_workers') or 1)
+    fft_workers = configs.get('fft_workers')
+    out_dir = configs['out_dir']
+    makedirs(out_dir, exist_ok=True)
+
+    outputs = {
+        'original_data': join(out_dir, f'original_data.{output_format}'),
+        'transformed_data': join(out_dir, f'transformed_data.{output_format}'),
+        'phase_data': join(out_dir, f'phase_data.{output_format}'),
+    }
+    if configs.get('save_repeat_statistics'):
+        # Computed while loading, no later stage changes them
+        outputs['variance_data'] = join(out_dir, f'variance_data.{output_format}')
+        outputs['standard_error_data'] = join(out_dir, f'standard_error_data.{output_format}')
+        spectral_data.save_array_to(outputs['variance_data'], spectral_data.variance)
+        spectral_data.save_array_to(outputs['standard_error_data'], spectral_data.standard_error)
+    # Declared as one plan so the transforms and the weighting run in a single pass
+    plan = spectral_data.plan().save_to(outputs['original_data'])
+    if baseline_correction_method is not None:
+        outputs['baseline_corrected_data'] = join(out_dir, f'baseline_corrected_data.{output_format}')
+        plan.baseline_correct(
+            method=baseline_correction_method,
+            configs=(configs.get('baseline_correction_configs')
+                     or constants.BASELINE_DEFAULT_CONFIGS.get(baseline_correction_method.lower())),
+            workers=baseline_workers,
+            warm_start=bool(configs.get('baseline_warm_start')))
+        plan.save_to(outputs['baseline_corrected_data'])
+
+    if weight_files:
+        # One transform for all weightings, weight_file is written to transformed_data
+        bank = {}
+        if weight_file is not None:
+            bank['transformed_data'] = weight_file
+        else:
+            del outputs['transformed_data']
+        for fpath in weight_files:
+            name = f'transformed_data_{splitext(basename(fpath))[0]}'
+            if name in bank:
+                raise ValueError(f'weight_files contains two files named {basename(fpath)}')
+            bank[name] = fpath
+            outputs[name] = join(out_dir, f'{name}.{output_format}')
+        plan.filter_bank(list(bank.values()), [outputs[name] for name in bank], workers=fft_workers)
+    else:
+        plan.fourier_transform(workers=fft_workers)
+        if weight_file is not None:
+            plan.weight(fpath=weight_file)
+        plan.inverse_fourier_transform(workers=fft_workers)
+        plan.save_to(outputs['transformed_data'])
+    # The phase is that of the transform, unaffected by the weighting and the inverse
+    plan.save_phase_to(outputs['phase_data'])
+    plan.execute()
+    return outputs
+
+
+def run(configs: dict) -> Dict[str, str]:
+    """Loads spectrum_dir and processes it, see process."""
+    check_configs(configs)
+    return process(load(configs), configs)
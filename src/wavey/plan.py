@@ -0,0 +1,156 @@
+"""Processing plans declared on Data and executed as fused passes over its rows."""
+from __future__ import annotations
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+BASELINE_CORRECT = 'baseline_correct'
+FOURIER_TRANSFORM = 'fourier_transform'
+WEIGHT = 'weight'
+FILTER_BANK = 'filter_bank'
+INVERSE_FOURIER_TRANSFORM = 'inverse_fourier_transform'
+SAVE = 'save'
+SAVE_PHASE = 'save_phase'
+
+# Stages working on every row independently, consecutive ones run in a single pass
+ROW_STAGES = (FOURIER_TRANSFORM, WEIGHT, INVERSE_FOURIER_TRANSFORM)
+
+
+class Plan:
+    """Operations on a Data object that are declared first and run by execute.
+
+    Consecutive row wise stages (fourier_transform, weight and inverse_fourier_transform)
+    are fused into one pass over the row chunks of y: each chunk is transformed, weighted
+    and transformed back before the next one is read, and the result is written back into
+    y in place. The imaginary component is never stored and the phase only when a
+    save_phase_to follows the transform. The baseline correction works on columns and the
+    saves need the whole matrix, so they separate the passes. A filter_bank step runs its
+    own pass and leaves y unchanged.
+
+    The outputs are identical to calling the Data methods in the same order, except that
+    Data.ft_imaginary_component is not filled.
+
+    Example:
+        data.plan().baseline_correct('arpls', configs).fourier_transform().weight(fpath) \\
+            .inverse_fourier_transform().save_to(fpath).save_phase_to(phase_fpath).execute()
+    """
+
+    def __init__(self, data: Data) -> None:
+        self.data = data
+        self.steps: List[Tuple[str, dict]] = []
+
+    def baseline_correct(self, method: str, configs: dict, workers: int=1, warm_start: bool=False) -> Plan:
+        """See Data.baseline_correct, configs is checked and copied when the step is declared."""
+        self.data._check_baseline_configs(method, configs)
+        self.steps.append((BASELINE_CORRECT, dict(method=method, configs=dict(configs), workers=workers,
+                                                   warm_start=warm_start)))
+        return self
+
+    def fourier_transform(self, workers: int=None, real_input: bool=False) -> Plan:
+        """See Data.fourier_transform."""
+        self.steps.append((FOURIER_TRANSFORM, dict(workers=workers, real_input=real_input)))
+        return self
+
+    def weight(self, fpath: str) -> Plan:
+        """See Data.weight. The weights are read and checked when the step is declared."""
+        self.steps.append((WEIGHT, dict(weights=self.data._read_weights(fpath))))
+        return self
+
+    def filter_bank(self, fpaths: Sequence[str], out_fpaths: Sequence[str], workers: int=None,
+                    real_input: bool=False, fmt: str=None) -> Plan:
+        """Runs Data.filter_bank on y as it is at this point of the plan and saves output i
+        to out_fpaths[i]. The weights are read and checked when the step is declared."""
+        if len(fpaths) != len(out_fpaths):
+            raise ValueError(f'{len(fpaths)} weight files but {len(out_fpaths)} output files')
+        for fpath in fpaths:
+            self.data._read_weights(fpath)
+        self.steps.append((FILTER_BANK, dict(fpaths=list(fpaths), out_fpaths=list(out_fpaths),
+                                             workers=workers, real_input=real_input, fmt=fmt)))
+        return self
+
+    def inverse_fourier_transform(self, workers: int=None) -> Plan:
+        """See Data.inverse_fourier_transform."""
+        self.steps.append((INVERSE_FOURIER_TRANSFORM, dict(workers=workers)))
+        return self
+
+    def save_to(self, fpath: str, fmt: str=None) -> Plan:
+        """Saves x and y as they are at this point of the plan, see Data.save_to."""
+        self.steps.append((SAVE, dict(fpath=fpath, fmt=fmt)))
+        return self
+
+    def save_phase_to(self, fpath: str, fmt: str=None) -> Plan:
+        """Saves x and the phase of the last fourier_transform or filter_bank before this step."""
+        self.steps.append((SAVE_PHASE, dict(fpath=fpath, fmt=fmt)))
+        return self
+
+    def _phase_needed(self, start: int) -> bool:
+        """Whether a save_phase_to comes after step start, before the next transform."""
+        for name, _ in self.steps[start:]:
+            if name == SAVE_PHASE:
+                return True
+            if name in (FOURIER_TRANSFORM, FILTER_BANK):
+                return False
+        return False
+
+    def _run_row_pass(self, steps: List[Tuple[str, dict]], keep_phase: bool) -> None:
+        from scipy.fft import ifft
+        data = self.data
+        instrumentation = data._instrumentation
+        num_rows = data._y.shape[0]
+        last_transform = max((i for i, (name, _) in enumerate(steps) if name == FOURIER_TRANSFORM), default=-1)
+        with instrumentation.stage('+'.join(name for name, _ in steps)):
+            # The transform of a pass starting on a tracked y goes through the stage cache
+            forward = None
+            if steps[0][0] == FOURIER_TRANSFORM:
+                forward = data._forward_stage(steps[0][1]['workers'], steps[0][1]['real_input'])
+            for rows in data._row_chunks():
+                data._check_cancelled()
+                block = data._y[rows]
+                for step_id, (name, kwargs) in enumerate(steps):
+                    if name == FOURIER_TRANSFORM:
+                        if step_id == 0:
+                            real, imag = forward(rows)
+                        else:
+                            real, imag = data._forward_transform(block, kwargs['workers'], kwargs['real_input'])
+                        block = real
+                        if keep_phase and step_id == last_transform:
+                            data.phase[rows] = data._phase(block, imag)
+                    elif name == WEIGHT:
+                        block *= kwargs['weights']
+                    else:
+                        block = np.real(ifft(block, axis=-1, workers=kwargs['workers']))
+                data._y[rows] = block
+                instrumentation.progress(rows.stop, num_rows)
+            if forward is not None:
+                forward.store()
+        # y only still matches the key of the transform when nothing followed it
+        data._stage_key = forward.key if forward is not None and len(steps) == 1 else None
+
+    def execute(self) -> Data:
+        """Runs the declared steps in order and returns the Data object."""
+        data = self.data
+        step_id = 0
+        while step_id < len(self.steps):
+            data._check_cancelled()
+            name, kwargs = self.steps[step_id]
+            if name in ROW_STAGES:
+                end = step_id
+                while end < len(self.steps) and self.steps[end][0] in ROW_STAGES:
+                    end += 1
+                self._run_row_pass(self.steps[step_id:end], keep_phase=self._phase_needed(end))
+                step_id = end
+                continue
+            if name == BASELINE_CORRECT:
+                data.baseline_correct(method=kwargs['method'], configs=dict(kwargs['configs']),
+                                      workers=kwargs['workers'], warm_start=kwargs['warm_start'])
+            elif name == FILTER_BANK:
+                outputs = data.filter_bank(kwargs['fpaths'], workers=kwargs['workers'],
+                                           real_input=kwargs['real_input'])
+                for out_fpath, values in zip(kwargs['out_fpaths'], outputs):
+                    data.save_array_to(out_fpath, values, fmt=kwargs['fmt'])
+            elif name == SAVE:
+                data.save_to(kwargs['fpath'], fmt=kwargs['fmt'])
+            elif name == SAVE_PHASE:
+                data.save_phase_to(kwargs['fpath'], fmt=kwargs['fmt'])
+            step_id += 1
+        return data
@@ -0,0 +1,27 @@
+"""Spread of the spectra across the repetitions of an experiment, accumulated in one pass."""
+from __future__ import annotations
+
+import numpy as np
+
+
+def add_squared_deviations(m2: np.ndarray, previous_sum: np.ndarray, count: int, value: np.ndarray) -> None:
+    """Welford update of m2, the sum of squared deviations from the mean, in place.
+
+    value is the count-th sample of the series and previous_sum the sum of the count - 1
+    samples before it. The deviations are taken from the running mean, which keeps the
+    result accurate when the spread is small compared to the mean, unlike summing squares.
+    """
+    if count < 2:
+        return
+    previous_mean = previous_sum / (count - 1)
+    mean = (previous_sum + value) / count
+    m2 += (value - previous_mean) * (value - mean)
+
+
+def variance_from_squared_deviations(m2: np.ndarray, count: int) -> None:
+    """Turns m2 of count samples into their sample variance (ddof=1) in place, NaN for
+    a single sample."""
+    if count < 2:
+        m2[:] = np.nan
+    else:
+        m2 /= count - 1
@@ -0,0 +1,331 @@
+"""Local processing daemon keeping loaded datasets in memory between requests.
+
+The server speaks JSON over HTTP, on a localhost TCP port or on a Unix socket:
+    GET  /status    the datasets in the pool and its hit and miss counts.
+    POST /process   a wavey.py configuration, runs pipeline.process and returns
+                    {'outputs': {name: path}}.
+    POST /plan      {'configs': configuration, 'steps': [[name, kwargs], ...]} runs the
+                    steps, named after the Plan methods in PLAN_STEPS, e.g.
+                    [['baseline_correct', {'method': 'arpls', 'configs': {...}}],
+                     ['fourier_transform', {}], ['save_to', {'fpath': ...}]].
+    POST /shutdown  stops the server.
+
+The server reads and writes any path a request names, so only the user who started it
+may talk to it: every request must carry the token serve writes to a file only that user
+can read (see token_path), POSTs must be application/json, requests from web pages
+(with an Origin header) are refused and so are Host headers other than loopback ones,
+against DNS rebinding. The default address is a Unix socket only that user can open.
+
+Every request works on a copy of the pooled Data, so the pooled datasets are never
+modified and concurrent requests on the same dataset do not interfere. The process
+stays up, so the imports, the parsed weight files and the ARPLS penalty matrices of
+earlier requests stay warm as well.
+"""
+from __future__ import annotations
+from collections import OrderedDict
+import hmac
+import http.client
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+from os.path import dirname, expanduser, join
+import secrets
+import socket
+import socketserver
+import threading
+from typing import Dict, Optional, Tuple, Union
+
+from wavey import pipeline
+from wavey.cache import file_signatures
+from wavey.data import Data
+from wavey.exceptions import DataError
+
+SERVER_DIR = join(expanduser('~'), '.wavey')
+# A Unix socket where available, its permissions keep other users out
+DEFAULT_ADDRESS = join(SERVER_DIR, 'server.sock') if hasattr(socket, 'AF_UNIX') else '127.0.0.1:8765'
+DEFAULT_POOL_MEGABYTES = 2048
+# Hosts the TCP server may listen on, it reads and writes any path a client names
+LOOPBACK_HOSTS = ('127.0.0.1', 'localhost', '::1')
+# Plan methods a /plan request may call
+PLAN_STEPS = ('baseline_correct', 'fourier_transform', 'weight', 'inverse_fourier_transform',
+              'filter_bank', 'save_to', 'save_phase_to')
+# Request header carrying the token of the server
+TOKEN_HEADER = 'X-Wavey-Token'
+# Configuration keys that select and shape the loaded dataset, and the caches it was
+# loaded with, copies share the stage cache of the pooled dataset
+DATASET_KEYS = ('spectrum_dir', 'number_of_time_points', 'start_frame', 'end_frame', 'spectra_type',
+                'x_min', 'x_max', 'bin_width', 'decimation', 'dtype', 'save_repeat_statistics',
+                'cache_dir', 'cache_max_megabytes', 'stage_cache_dir', 'stage_cache_max_megabytes')
+
+
+def parse_address(address: str) -> Union[Tuple[str, int], str]:
+    """Returns (host, port) for 'host:port' and the socket path for anything else."""
+    host, _, port = address.rpartition(':')
+    if host and port.isdigit():
+        return host.strip('[]'), int(port)
+    return address
+
+
+def token_path(address: str) -> str:
+    """Returns the path of the file holding the token of the server at address."""
+    parsed = parse_address(address)
+    if isinstance(parsed, tuple):
+        return join(SERVER_DIR, f'server_{parsed[1]}.token')
+    return parsed + '.token'
+
+
+def write_token(fpath: str, token: str) -> None:
+    """Writes token to fpath, readable and writable by the current user only."""
+    os.makedirs(dirname(fpath) or '.', exist_ok=True)
+    fd = os.open(fpath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as fp:
+        os.chmod(fpath, 0o600)  # In case the file existed with other permissions
+        fp.write(token)
+
+
+def read_token(address: str) -> str:
+    """Returns the token of the server at address.
+
+    Raises:
+        DataError: when there is no token file, e.g. no server runs at address.
+    """
+    try:
+        with open(token_path(address), 'r') as fp:
+            return fp.read().strip()
+    except FileNotFoundError:
+        raise DataError(f'No token at {token_path(address)}, is the server running on {address}?')
+
+
+class DataPool:
+    """Loaded datasets by configuration, the least recently used are dropped once they
+    hold more than max_bytes. The newest dataset is always kept.
+
+    A dataset is identified by its DATASET_KEYS and by the path, size and modification
+    time of the files of spectrum_dir, so new or edited files load it again and requests
+    naming another cache or stage cache get a dataset using that one. Pooled
+    datasets live in memory, backing_dir is ignored.
+    """
+
+    def __init__(self, max_bytes: int=DEFAULT_POOL_MEGABYTES * 1024 ** 2) -> None:
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        # One lock per dataset, so a dataset is loaded once while others are served
+        self._load_locks: Dict[str, threading.Lock] = {}
+
+    @staticmethod
+    def _key(configs: dict) -> str:
+        fpaths = Data.list_files(configs['spectrum_dir'], configs.get('spectra_type'))
+        return json.dumps([[configs.get(key) for key in DATASET_KEYS], file_signatures(fpaths)], default=str)
+
+    @staticmethod
+    def _nbytes(data: Data) -> int:
+        return data.x.nbytes + data.y.nbytes + sum(array.nbytes for array in data._auxiliary.values())
+
+    def checkout(self, configs: dict) -> Data:
+        """Returns a copy of the dataset of configs, loading it on a miss."""
+        key = self._key(configs)
+        with self._lock:
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+        with load_lock:
+            with self._lock:
+                data = self._entries.get(key)
+                if data is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+            if data is None:
+                data = pipeline.load(dict(configs, backing_dir=None))
+                with self._lock:
+                    self.misses += 1
+                    self._entries[key] = data
+                    self._evict()
+        return data.copy()
+
+    def _evict(self) -> None:
+        total_bytes = sum(self._nbytes(data) for data in self._entries.values())
+        while total_bytes > self.max_bytes and len(self._entries) > 1:
+            key, data = self._entries.popitem(last=False)
+            self._load_locks.pop(key, None)
+            total_bytes -= self._nbytes(data)
+
+    def status(self) -> dict:
+        with self._lock:
+            datasets = [{'spectrum_dir': json.loads(key)[0][0], 'bytes': self._nbytes(data)}
+                        for key, data in self._entries.items()]
+            return {'datasets': datasets, 'bytes': sum(dataset['bytes'] for dataset in datasets),
+                    'max_bytes': self.max_bytes, 'hits': self.hits, 'misses': self.misses}
+
+
+def run_plan(data: Data, steps: list) -> Data:
+    """Declares steps, [name, kwargs] pairs of PLAN_STEPS, on a plan of data and executes it."""
+    plan = data.plan()
+    for name, kwargs in steps:
+        if name not in PLAN_STEPS:
+            raise ValueError(f'step {name} not recognized, use one of {PLAN_STEPS}')
+        getattr(plan, name)(**kwargs)
+    return plan.execute()
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """Serves the requests listed in the module docstring from server.pool."""
+
+    def address_string(self) -> str:
+        # Unix socket clients have no address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'local'
+
+    def _reply(self, status: int, payload: dict) -> None:
+        body = json.dumps(payload, default=str).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _refusal(self) -> Optional[Tuple[int, str]]:
+        """Returns the status and reason a request is refused with, None when it is not."""
+        if self.headers.get('Origin') is not None:
+            return 403, 'cross origin requests are not allowed'
+        host = parse_address(self.headers.get('Host') or '')
+        if (host[0] if isinstance(host, tuple) else host) not in LOOPBACK_HOSTS:
+            return 403, f"host {self.headers.get('Host')} is not a loopback address"
+        if not hmac.compare_digest(self.headers.get(TOKEN_HEADER) or '', self.server.token):
+            return 403, f'missing or wrong {TOKEN_HEADER}, see token_path'
+        if self.command == 'POST' and self.headers.get_content_type() != 'application/json':
+            return 415, 'requests must be application/json'
+        return None
+
+    def do_GET(self) -> None:
+        refusal = self._refusal()
+        if refusal is not None:
+            self._reply(refusal[0], {'error': refusal[1]})
+        elif self.path == '/status':
+            self._reply(200, self.server.pool.status())
+        else:
+            self._reply(404, {'error': f'{self.path} not found'})
+
+    def do_POST(self) -> None:
+        refusal = self._refusal()
+        if refusal is not None:
+            self._reply(refusal[0], {'error': refusal[1]})
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b'{}')
+            if self.path == '/process':
+                pipeline.check_configs(payload)
+                result = {'outputs': pipeline.process(self.server.pool.checkout(payload), payload)}
+            elif self.path == '/plan':
+                run_plan(self.server.pool.checkout(payload['configs']), payload['steps'])
+                result = {'steps': len(payload['steps'])}
+            elif self.path == '/shutdown':
+                # shutdown() waits for serve_forever, which waits for this request
+                threading.Thread(target=self.server.shutdown, daemon=True).start()
+                result = {}
+            else:
+                self._reply(404, {'error': f'{self.path} not found'})
+                return
+        except (DataError, KeyError, TypeError, ValueError, OSError) as e:
+            self._reply(400, {'error': f'{type(e).__name__}: {e}'})
+        except Exception as e:
+            self._reply(500, {'error': f'{type(e).__name__}: {e}'})
+        else:
+            self._reply(200, result)
+
+
+class ThreadingHTTPServerV6(ThreadingHTTPServer):
+    address_family = socket.AF_INET6
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(address: str=DEFAULT_ADDRESS, pool: DataPool=None, token: str=None):
+    """Returns a server for address, 'host:port' on a loopback host or a socket path only
+    the current user can open. Every request runs on its own thread and must carry token,
+    a new random one by default, see server.token."""
+    parsed = parse_address(address)
+    if isinstance(parsed, tuple):
+        if parsed[0] not in LOOPBACK_HOSTS:
+            raise ValueError(f'host {parsed[0]} is not a loopback address, use one of {LOOPBACK_HOSTS}')
+        server_class = ThreadingHTTPServerV6 if ':' in parsed[0] else ThreadingHTTPServer
+        server = server_class(parsed, RequestHandler)
+    else:
+        if os.path.exists(parsed):
+            os.remove(parsed)  # Left behind by a server that did not shut down cleanly
+        os.makedirs(dirname(parsed) or '.', exist_ok=True)
+        # The socket is created with the permissions the umask leaves, owner only
+        umask = os.umask(0o177)
+        try:
+            server = ThreadingUnixHTTPServer(parsed, RequestHandler)
+        finally:
+            os.umask(umask)
+    server.pool = pool or DataPool()
+    server.token = token or secrets.token_hex(32)
+    return server
+
+
+def serve(address: str=DEFAULT_ADDRESS, pool_max_bytes: int=DEFAULT_POOL_MEGABYTES * 1024 ** 2) -> None:
+    """Serves requests on address until /shutdown or an interrupt. The token of the
+    server is written to token_path(address) for the duration."""
+    server = make_server(address, DataPool(pool_max_bytes))
+    write_token(token_path(address), server.token)
+    print('Serving on ', address)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if isinstance(server, ThreadingUnixHTTPServer) and os.path.exists(address):
+            os.remove(address)
+        if os.path.exists(token_path(address)):
+            os.remove(token_path(address))
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path: str, timeout: float=None) -> None:
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def request(address: str, method: str, path: str, payload: dict=None, timeout: float=None,
+            token: str=None) -> dict:
+    """Sends a request to the server at address and returns its JSON reply. token defaults
+    to the one the server wrote to token_path(address).
+
+    Raises:
+        DataError: when the server replies with an error or there is no token.
+    """
+    token = token or read_token(address)
+    parsed = parse_address(address)
+    if isinstance(parsed, tuple):
+        connection = http.client.HTTPConnection(*parsed, timeout=timeout)
+    else:
+        connection = _UnixHTTPConnection(parsed, timeout=timeout)
+    try:
+        body = None if method == 'GET' else json.dumps(payload or {}, default=str)
+        headers = {TOKEN_HEADER: token}
+        if body is not None:
+            headers['Content-Type'] = 'application/json'
+        connection.request(method, path, body=body, headers=headers)
+        response = connection.getresponse()
+        reply = json.loads(response.read() or b'{}')
+    finally:
+        connection.close()
+    if response.status != 200:
+        raise DataError(f"Server replied {response.status}: {reply.get('error')}")
+    return reply
+
+
+def submit(configs: dict, address: str=DEFAULT_ADDRESS) -> Dict[str, str]:
+    """Processes configs on the server at address, see pipeline.run."""
+    return request(address, 'POST', '/process', configs)['outputs']
@@ -0,0 +1,95 @@
+"""Synthetic modulation excitation spectra in the file formats read by wavey.parsers."""
+from __future__ import annotations
+from os import makedirs
+from os.path import join
+from typing import List, Sequence
+
+import numpy as np
+
+from wavey.parsers import IR, RAMAN, RAMAN_X_NAME, RAMAN_Y_NAME, UV_VIS
+
+FILE_EXTENSIONS = {
+    RAMAN: 'csv',
+    IR: 'csv',
+    UV_VIS: 'TXT',
+}
+
+
+def make_baseline(x: np.ndarray) -> np.ndarray:
+    """The sloped, curved baseline under the synthetic spectra."""
+    return 0.05 * x + 2e-5 * (x - 1700) ** 2
+
+
+def make_spectra(num_sampling_points: int, num_time_points: int, num_repeats: int,
+                 seed: int=0) -> np.ndarray:
+    """Returns x of shape (num_sampling_points,) and y of shape
+    (num_sampling_points, num_time_points * num_repeats).
+
+    Two peaks are modulated at the first harmonic with a phase lag between them and sit on
+    a sloped, curved baseline, see make_baseline, with Gaussian noise.
+    """
+    rng = np.random.default_rng(seed)
+    x = np.linspace(200., 3200., num_sampling_points)
+    t = np.arange(num_time_points * num_repeats) % num_time_points
+    phase = 2 * np.pi * t / num_time_points
+    peak_1 = 800 * np.exp(-((x - 1000) / 30) ** 2)
+    peak_2 = 500 * np.exp(-((x - 1600) / 45) ** 2)
+    baseline = make_baseline(x)
+    y = (baseline[:, None]
+         + peak_1[:, None] * (1 + 0.2 * np.sin(phase))[None, :]
+         + peak_2[:, None] * (1 + 0.1 * np.sin(phase - np.pi / 3))[None, :]
+         + rng.normal(0, 3, (num_sampling_points, len(t))))
+    return x, y
+
+
+def _raman_text(x: np.ndarray, y: np.ndarray) -> str:
+    lines = ['File Version,BWSpec4.11_1', 'integration times(ms),1000', '',
+             f'Pixel,Wavelength,{RAMAN_X_NAME},Dark,Reference,{RAMAN_Y_NAME}']
+    lines += [f'{i},{785 + 0.05 * i:.3f},{x_i:.4f},1000,0,{y_i:.6f}' for i, (x_i, y_i) in enumerate(zip(x, y))]
+    return '\n'.join(lines) + '\n'
+
+
+def _ir_text(x: np.ndarray, y: np.ndarray) -> str:
+    return '\n'.join(f'{x_i:.4f},{y_i:.6f}' for x_i, y_i in zip(x, y)) + '\n'
+
+
+def _uv_vis_text(x: np.ndarray, y: np.ndarray) -> str:
+    lines = ['Synthetic UV-Vis spectrum', 'Integration time;100', 'Wavelength;Dark;Reference;Sample;Absorbance']
+    lines += [f'{x_i:.4f};0;1;1;{y_i:.6f}' for x_i, y_i in zip(x, y)]
+    return '\n'.join(lines) + '\n'
+
+
+WRITERS = {
+    RAMAN: _raman_text,
+    IR: _ir_text,
+    UV_VIS: _uv_vis_text,
+}
+
+
+def write_dataset(out_dir: str, ftype: str, num_sampling_points: int, num_time_points: int,
+                  num_repeats: int=1, seed: int=0) -> List[str]:
+    """Writes num_time_points * num_repeats spectrum files of type ftype to out_dir.
+
+    Returns:
+        paths of the written files, in acquisition order.
+    """
+    makedirs(out_dir, exist_ok=True)
+    x, y = make_spectra(num_sampling_points, num_time_points, num_repeats, seed=seed)
+    writer = WRITERS[ftype.lower()]
+    fpaths = []
+    for file_id in range(y.shape[-1]):
+        fpath = join(out_dir, f'spectrum_{file_id}.{FILE_EXTENSIONS[ftype.lower()]}')
+        with open(fpath, 'w') as fp:
+            fp.write(writer(x, y[:, file_id]))
+        fpaths.append(fpath)
+    return fpaths
+
+
+def write_weights(fpath: str, num_time_points: int, harmonics: Sequence[int]=(1,)) -> None:
+    """Writes a weight file keeping the given harmonics and their negative frequencies."""
+    weights = np.zeros(num_time_points)
+    for k in harmonics:
+        weights[k] = 1
+        weights[-k] = 1
+    with open(fpath, 'w') as fp:
+        fp.write('weights\n' + '\n'.join(str(w) for w in weights) + '\n')
@@ -0,0 +1,154 @@
+"""Live processing of an experiment directory while the spectra are being acquired."""
+from __future__ import annotations
+import os
+import time
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from wavey.cache import SpectrumCache
+from wavey.data import Data
+from wavey.exceptions import DataError
+from wavey.parsers import Region, load_spectrum
+from wavey import pipeline
+from wavey.repeats import add_squared_deviations
+
+
+class RunningAverage:
+    """Per time point running sum of the spectra folded in so far, and with
+    repeat_statistics their running sum of squared deviations from the mean."""
+
+    def __init__(self, num_time_points: int, repeat_statistics: bool=False) -> None:
+        self.num_time_points = num_time_points
+        self.repeat_statistics = repeat_statistics
+        self.x = None
+        self.sums = None
+        self.squared_deviations = None
+        self.counts = np.zeros(num_time_points, dtype=np.int64)
+
+    def add(self, time_point: int, x: np.ndarray, y: np.ndarray) -> None:
+        if self.sums is None:
+            self.x = x
+            self.sums = np.zeros((x.shape[0], self.num_time_points))
+            if self.repeat_statistics:
+                self.squared_deviations = np.zeros_like(self.sums)
+        elif self.x.shape != x.shape:
+            raise DataError('Different x-axis size between files')
+        if self.squared_deviations is not None:
+            add_squared_deviations(self.squared_deviations[:, time_point], self.sums[:, time_point],
+                                   self.counts[time_point] + 1, y[:, 0])
+        self.sums[:, time_point] += y[:, 0]
+        self.counts[time_point] += 1
+
+    @property
+    def num_files(self) -> int:
+        return int(self.counts.sum())
+
+    def mean(self) -> np.ndarray:
+        """Average of every time point, time points without a file yet are zero."""
+        return self.sums / np.maximum(self.counts, 1)
+
+    def variance(self) -> np.ndarray:
+        """Sample variance of every time point, NaN for time points with fewer than two files."""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self.counts > 1, self.squared_deviations / (self.counts - 1), np.nan)
+
+
+class DirectoryWatcher:
+    """Polls a directory for spectrum files that have finished being written.
+
+    A file is ready once its size did not change between two polls. Files are released
+    in natsort order and only as a contiguous run, so a file is never handed out before
+    one that sorts ahead of it.
+    """
+
+    def __init__(self, in_dir: str, ftype: str) -> None:
+        self.in_dir = in_dir
+        self.ftype = ftype
+        self._num_released = 0
+        self._last_sizes: Dict[str, int] = {}
+
+    def poll(self) -> List[str]:
+        pending = Data.list_files(self.in_dir, self.ftype)[self._num_released:]
+        ready = []
+        sizes = {}
+        contiguous = True
+        for fpath in pending:
+            try:
+                sizes[fpath] = os.path.getsize(fpath)
+            except FileNotFoundError:
+                break
+            stable = sizes[fpath] > 0 and self._last_sizes.get(fpath) == sizes[fpath]
+            contiguous = contiguous and stable
+            if contiguous:
+                ready.append(fpath)
+        self._last_sizes = sizes
+        self._num_released += len(ready)
+        return ready
+
+
+def watch(configs: dict, poll_interval: float=1.0,
+          on_update: Callable[[int, Dict[str, str]], None]=None,
+          should_stop: Callable[[], bool]=None) -> Optional[Data]:
+    """Folds every new file of spectrum_dir into a running per time point average and
+    reprocesses the average each time a full period of number_of_time_points files is in.
+
+    Every file is parsed exactly once, so the work per new file does not grow with the
+    number of files already acquired. The outputs in out_dir are overwritten after each
+    period, and the cache_dir, if set, is trimmed to cache_max_megabytes. Runs until end_frame is reached, should_stop() returns True or the process
+    is interrupted.
+
+    Args:
+        configs: the wavey.py configuration.
+        poll_interval: seconds between two scans of spectrum_dir.
+        on_update: called as on_update(num_periods, outputs) after each period.
+        should_stop: polled once per scan.
+
+    Returns:
+        Data of the last completed period, None if no period completed.
+    """
+    num_time_points = int(configs.get('number_of_time_points'))
+    ftype = configs.get('spectra_type')
+    start = configs.get('start_frame') or 0
+    end = configs.get('end_frame')
+    end = None if end is None or end == -1 else end
+    cache = None
+    if configs.get('cache_dir') is not None:
+        cache_max_megabytes = configs.get('cache_max_megabytes') or pipeline.DEFAULT_CACHE_MAX_MEGABYTES
+        cache = SpectrumCache(configs['cache_dir'], max_bytes=int(cache_max_megabytes * 1024 ** 2))
+    load = load_spectrum if cache is None else cache.load
+    region = Region(x_min=configs.get('x_min'), x_max=configs.get('x_max'),
+                    bin_width=configs.get('bin_width'), decimation=configs.get('decimation'))
+
+    watcher = DirectoryWatcher(configs['spectrum_dir'], ftype)
+    repeat_statistics = bool(configs.get('save_repeat_statistics'))
+    average = RunningAverage(num_time_points, repeat_statistics=repeat_statistics)
+    spectral_data = None
+    file_id = -1
+    print('Watching ', configs['spectrum_dir'])
+    while should_stop is None or not should_stop():
+        for fpath in watcher.poll():
+            file_id += 1
+            if file_id < start:
+                continue
+            if end is not None and file_id > end:
+                return spectral_data
+            x, y = load(fpath=fpath, ftype=ftype, region=region)
+            average.add((file_id - start) % num_time_points, x, y)
+            if average.num_files % num_time_points == 0:
+                num_periods = average.num_files // num_time_points
+                print(f'Period {num_periods} complete, processing')
+                spectral_data = Data.from_arrays(average.x, average.mean(),
+                                                 backing_dir=configs.get('backing_dir'),
+                                                 dtype=configs.get('dtype') or 'float64',
+                                                 variance=average.variance() if repeat_statistics else None,
+                                                 num_repeats=num_periods)
+                outputs = pipeline.process(spectral_data, configs)
+                if cache is not None:
+                    cache.evict()
+                if on_update is not None:
+                    on_update(num_periods, outputs)
+        if end is not None and file_id >= end:
+            return spectral_data
+        time.sleep(poll_interval)
+    return spectral_data